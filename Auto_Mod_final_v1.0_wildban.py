@@ -17,6 +17,21 @@ import time
 import json
 import random
 import fnmatch
+import hashlib
+import heapq
+import itertools
+import zlib
+import functools
+from collections import deque, OrderedDict, namedtuple
+from types import MappingProxyType
+try:
+    import re._parser as sre_parse   # Python 3.11+
+except ImportError:
+    import sre_parse
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None   # some HexChat Python builds ship without it; the text files still work
 
 __module_name__ = "AutoMod by Jazzzzz"
 __module_version__ = "1.0 Powered by Jazzzzz"
@@ -37,6 +52,9 @@ SETTINGS_FILE = os.path.join(BASE_DIR, "automod_settings.json")
 README_PATH = os.path.join(BASE_DIR, "AutoMod_README.txt")
 LOG_FILE = os.path.join(BASE_DIR, "automod_log.txt")
 EXEMPT_FILE = os.path.join(BASE_DIR, "exempt.txt")
+BAN_LEDGER_FILE = os.path.join(BASE_DIR, "automod_bans.json")
+RULE_CACHE_FILE = os.path.join(BASE_DIR, "automod_rules.cache")
+STORE_FILE = os.path.join(BASE_DIR, "automod.db")
 
 # Random message files
 NICK_MSG_FILE = os.path.join(BASE_DIR, "nick_kickmsgs.txt")
@@ -67,6 +85,8 @@ ensure_random_msg_files()
 # -------------------------
 UNBAN_CHECK_MS = 60 * 1000
 KICK_DELAY_MS = 700
+FLOOD_SWEEP_MS = 60 * 1000
+FLOOD_MAX_KEYS = 5000      # cap on (channel, nick) pairs tracked for flooding
 
 DEFAULTS = {
     "UNBAN_MINUTES": 60,
@@ -74,19 +94,33 @@ DEFAULTS = {
     "BANMSG": "",
     "FLOOD_COUNT": 6,
     "FLOOD_SECONDS": 5,
-    "DEFAULT_BAN_MINUTES": 60
+    "DEFAULT_BAN_MINUTES": 60,
+    "JOINFLOOD_COUNT": 8,
+    "JOINFLOOD_SECONDS": 3,
+    "LOCKDOWN_MODES": "i",
+    "LOCKDOWN_SECONDS": 120,
+    "DUPFLOOD_NICKS": 0,
+    "DUPFLOOD_SECONDS": 30,
+    "MAX_MSG_LENGTH": 512,
+    "STORE": "files",
+    "STORE_PATH": ""
 }
 
 # -------------------------
 # Runtime state
 # -------------------------
 settings = {}
-bad_nick_rules = {}   # pattern -> (compiled_re, message, minutes, is_wild)
-bad_word_rules = {}
-protected_channels = set()
-flood_records = {}    # (chan_lower, nick_lower) -> [timestamps]
+# Everything loaded from the rule/exempt/channel files lives in one immutable
+# snapshot; changes build a new RuleSet and publish_ruleset() swaps it in whole.
+# Handlers read `ruleset` once per event so they never see a half-applied reload.
+#   nick_rules / word_rules: pattern -> (compiled_re, message, minutes, is_wild, options)
+#   nick_engine / word_engine: compile_scoped_engine() over compile_nick_engine() / compile_rule_engine()
+#   exempt: frozenset of exempt.txt entries, exempt_matcher: compile_exempt_matcher()
+#   protected: frozenset of protected channel names (lowercase)
+RuleSet = namedtuple("RuleSet", "nick_rules nick_engine word_rules word_engine exempt exempt_matcher protected")
+ruleset = None
+flood_records = OrderedDict()   # (network, chan_lower, nick_lower) -> deque of last FLOOD_COUNT timestamps, LRU order
 whitelist_nicks = set(["ChanServ", "NickServ"])
-exempt_set = set()    # loaded from exempt.txt
 
 # -------------------------
 # Logging & persistence
@@ -94,29 +128,93 @@ exempt_set = set()    # loaded from exempt.txt
 def timestamp():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
-def log(msg):
-    try:
-        # print to HexChat console (AutoMod tab)
+LOG_FLUSH_MS = 2000
+LOG_MAX_BYTES = 1024 * 1024   # rotate automod_log.txt past this size
+LOG_BACKUPS = 3               # automod_log.txt.1 .. .3
+
+log_buffer = []       # formatted lines waiting for flush_log()
+log_flush_hook = None
+log_ctx = None        # cached AutoMod query context
+
+def automod_context():
+    """AutoMod tab context, resolved (and created) only when not cached."""
+    global log_ctx
+    if log_ctx is None:
         ctx = hexchat.find_context(server=None, channel="AutoMod")
         if not ctx:
             hexchat.command("QUERY AutoMod")
             ctx = hexchat.find_context(channel="AutoMod")
-        ctx.prnt(f"[{timestamp()}] {msg}")
+        log_ctx = ctx
+    return log_ctx
+
+def on_close_context(word, word_eol, userdata):
+    global log_ctx
+    ctx = hexchat.get_context()
+    if log_ctx is not None and ctx == log_ctx:
+        log_ctx = None
+    for key in [k for k, c in channel_contexts.items() if c == ctx]:
+        del channel_contexts[key]
+    return hexchat.EAT_NONE
+
+def log(msg, channel=None, nick=None, rule=None, action=None):
+    fields = " ".join(
+        f"{k}={v}" for k, v in (("channel", channel), ("nick", nick), ("rule", rule), ("action", action))
+        if v is not None
+    )
+    line = f"{timestamp()} - {msg}" + (f" [{fields}]" if fields else "")
+    global log_ctx, log_flush_hook
+    try:
+        # print to HexChat console (AutoMod tab)
+        automod_context().prnt(line)
     except Exception:
+        log_ctx = None
         try:
             hexchat.prnt(f"[AutoMod] {msg}")
         except Exception:
             pass
+    log_buffer.append(line + "\n")
+    if log_flush_hook is None:
+        try:
+            log_flush_hook = hexchat.hook_timer(LOG_FLUSH_MS, flush_log)
+        except Exception:
+            flush_log()
+
+def rotate_log(incoming):
     try:
+        if os.path.getsize(LOG_FILE) + incoming <= LOG_MAX_BYTES:
+            return
+    except OSError:
+        return
+    for i in range(LOG_BACKUPS - 1, 0, -1):
+        src = f"{LOG_FILE}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{LOG_FILE}.{i + 1}")
+    if LOG_BACKUPS > 0:
+        os.replace(LOG_FILE, f"{LOG_FILE}.1")
+    else:
+        os.remove(LOG_FILE)
+
+def flush_log(userdata=None):
+    """Timer: write buffered log lines in one append."""
+    global log_flush_hook
+    log_flush_hook = None
+    if not log_buffer:
+        return False
+    data = "".join(log_buffer)
+    log_buffer.clear()
+    try:
+        rotate_log(len(data.encode("utf-8")))
         with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{timestamp()} - {msg}\n")
+            f.write(data)
     except Exception:
         pass
+    return False
 
 def save_settings():
     try:
         with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
             json.dump(settings, f, indent=2)
+        mark_seen(SETTINGS_FILE)
         log("Settings saved.")
     except Exception as e:
         log(f"Error saving settings: {e}")
@@ -131,10 +229,80 @@ def load_settings():
             settings = DEFAULTS.copy()
     else:
         settings = DEFAULTS.copy()
-    for k, v in DEFAULTS.items():
-        if k not in settings:
-            settings[k] = v
-    save_settings()
+    missing = [k for k in DEFAULTS if k not in settings]
+    for k in missing:
+        settings[k] = DEFAULTS[k]
+    if missing or not os.path.exists(SETTINGS_FILE):
+        save_settings()
+
+# -------------------------
+# Instrumentation (/AMSTATS)
+# -------------------------
+# Off by default: instrumented() then costs one flag check per call.
+STATS_BUCKETS_US = (10, 50, 100, 500, 1000, 5000, 10000, 50000)   # histogram upper bounds; last bucket is open
+
+stats_enabled = False
+stats_since = time.time()
+hook_stats = {}   # name -> [calls, total_ns, max_ns, bucket counts]
+rule_stats = {}   # (kind, pattern) -> [evals, total_ns, hits]
+
+def record_timing(name, ns):
+    st = hook_stats.get(name)
+    if st is None:
+        st = hook_stats[name] = [0, 0, 0, [0] * (len(STATS_BUCKETS_US) + 1)]
+    st[0] += 1
+    st[1] += ns
+    if ns > st[2]:
+        st[2] = ns
+    us = ns / 1000.0
+    for i, bound in enumerate(STATS_BUCKETS_US):
+        if us <= bound:
+            st[3][i] += 1
+            break
+    else:
+        st[3][-1] += 1
+
+def record_rule(kind, pattern, ns=None, hit=False):
+    """Count one evaluation (ns given) and/or one hit for a rule or engine pass."""
+    st = rule_stats.get((kind, pattern))
+    if st is None:
+        st = rule_stats[(kind, pattern)] = [0, 0, 0]
+    if ns is not None:
+        st[0] += 1
+        st[1] += ns
+    if hit:
+        st[2] += 1
+
+def instrumented(name):
+    """Decorator: time calls to the function under `name` while stats are on."""
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            if not stats_enabled:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_timing(name, time.perf_counter_ns() - t0)
+        return inner
+    return wrap
+
+def reset_stats():
+    global stats_since
+    hook_stats.clear()
+    rule_stats.clear()
+    stats_since = time.time()
+
+def histogram_percentile(buckets, q):
+    """Index of the histogram bucket holding the q-th percentile."""
+    want = q * sum(buckets)
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= want:
+            return i
+    return len(buckets) - 1
 
 # -------------------------
 # Rule file helpers
@@ -142,7 +310,7 @@ def load_settings():
 def ensure_files_exist(reset=False):
     files = [BAD_NICKS_FILE, BAD_WORDS_FILE, PROTECTED_FILE, EXEMPT_FILE, NICK_MSG_FILE, WORD_MSG_FILE, FLOOD_MSG_FILE]
     if reset:
-        for fp in files:
+        for fp in files + [journal_path(f) for f in (BAD_NICKS_FILE, BAD_WORDS_FILE, EXEMPT_FILE)]:
             try:
                 if os.path.exists(fp):
                     os.remove(fp)
@@ -157,7 +325,7 @@ def ensure_files_exist(reset=False):
                     elif fp == BAD_WORDS_FILE:
                         f.write("# bad_words.txt - pattern :: message :: minutes(optional)\n")
                     elif fp == PROTECTED_FILE:
-                        f.write("# protected_channels.txt - one channel per line (lowercase)\n")
+                        f.write("# protected_channels.txt - one channel per line (lowercase), '#chan' or 'network #chan'\n")
                     elif fp == EXEMPT_FILE:
                         f.write("# exempt.txt - one nick or mask per line (e.g. nick123 OR *!*@example.com)\n")
                     else:
@@ -166,6 +334,7 @@ def ensure_files_exist(reset=False):
                 log(f"Error creating {fp}: {e}")
 
 def parse_rule_line(line):
+    """'pattern :: message :: minutes :: options' -> (pattern, message, minutes, options tuple)"""
     parts = [p.strip() for p in line.split("::")]
     if not parts:
         return None
@@ -177,21 +346,40 @@ def parse_rule_line(line):
             duration = int(parts[2])
         except:
             duration = None
-    return pattern, message, duration
+    options = ()
+    if len(parts) >= 4:
+        options = tuple(o.lower() for o in re.split(r"[\s,]+", parts[3]) if o)
+    return pattern, message, duration, options
+
+class WildcardPattern(object):
+    """
+    Matcher for '*' wildcard rules without a regex: the literal fragments
+    between the stars must occur in order (case-insensitive). Each fragment is
+    found with str.find starting where the previous one ended, so the text is
+    scanned once - no backtracking whatever the rule or message.
+    `pattern` is the equivalent regex source, kept for display and the cache.
+    """
+    __slots__ = ("rule", "frags", "pattern")
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.frags = [f.lower() for f in rule.split("*") if f]
+        self.pattern = ".*".join(re.escape(f) for f in rule.split("*"))
+
+    def search(self, text, lowered=False):
+        if not lowered:
+            text = text.lower()
+        pos = 0
+        for frag in self.frags:
+            pos = text.find(frag, pos)
+            if pos < 0:
+                return False
+            pos += len(frag)
+        return True
 
 def pattern_to_regex(pat, is_new_rule=False):
     if "*" in pat and is_new_rule:
-        escaped = ""
-        for ch in pat:
-            if ch == "*":
-                escaped += ".*"
-            else:
-                escaped += re.escape(ch)
-        try:
-            cre = re.compile(escaped, re.IGNORECASE)
-            return cre, True
-        except re.error:
-            return None, False
+        return WildcardPattern(pat), True
     else:
         try:
             cre = re.compile(pat, re.IGNORECASE)
@@ -203,49 +391,761 @@ def pattern_to_regex(pat, is_new_rule=False):
             except Exception:
                 return None, False
 
-def load_rules_from_file(filename):
+# Raw-regex rules run on attacker-controlled text, so patterns that can
+# backtrack catastrophically are refused when a rule is added or loaded.
+RISKY_REPEAT_MIN = 10     # bounded repeats this large count as unbounded
+
+def regex_risk(pattern):
+    """
+    Why pattern could backtrack catastrophically (a short reason), or None.
+    Refused, among others: (a+)+b, (a|ab)*c, \w*\w*\w*!, a*a*a*b, .*a.*a.*b
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None     # not a regex; pattern_to_regex() matches it as plain text
+    return scan_regex(parsed, False) or scan_repeats(parsed, [])[0]
+
+def scan_regex(items, in_repeat):
+    """Walk a parsed regex; in_repeat is True below an unbounded (or large) quantifier."""
+    for op, av in items:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            lo, hi, sub = av
+            if in_repeat and (hi == sre_parse.MAXREPEAT or lo == 0):
+                return "nested quantifiers, e.g. (a+)+"
+            reason = scan_regex(sub, in_repeat or hi == sre_parse.MAXREPEAT or hi >= RISKY_REPEAT_MIN)
+        elif op is sre_parse.SUBPATTERN:
+            reason = scan_regex(av[-1], in_repeat)
+        elif op is sre_parse.BRANCH:
+            branches = av[1]
+            if in_repeat:
+                heads = [branch_head(b) for b in branches]
+                if "" in heads or None in heads or len(set(heads)) < len(heads):
+                    return "overlapping alternatives under a quantifier, e.g. (a|ab)*"
+            reason = None
+            for branch in branches:
+                reason = reason or scan_regex(branch, in_repeat)
+        elif op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return "backreference"
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            reason = scan_regex(av[1], in_repeat)
+        else:
+            reason = None
+        if reason:
+            return reason
+    return None
+
+# Character sets are compared over this sample (lowercase: rules match IGNORECASE)
+RISK_SAMPLE = frozenset(chr(i) for i in range(32, 127)).union(" \t\n_\u00a0\u00e9\u0436\uff10").difference("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+RISK_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r"\d", sre_parse.CATEGORY_NOT_DIGIT: r"\D",
+    sre_parse.CATEGORY_SPACE: r"\s", sre_parse.CATEGORY_NOT_SPACE: r"\S",
+    sre_parse.CATEGORY_WORD: r"\w", sre_parse.CATEGORY_NOT_WORD: r"\W",
+}
+
+def char_set(items):
+    """Sample characters any item of a parsed regex can consume (a superset is fine)."""
+    chars = set()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            chars.add(chr(av).lower())
+        elif op is sre_parse.NOT_LITERAL:
+            chars |= RISK_SAMPLE - {chr(av).lower()}
+        elif op is sre_parse.ANY:
+            chars |= RISK_SAMPLE - {"\n"}
+        elif op is sre_parse.IN:
+            negate = bool(av) and av[0][0] is sre_parse.NEGATE
+            inside = set()
+            for iop, iav in av[1:] if negate else av:
+                if iop is sre_parse.LITERAL:
+                    inside.add(chr(iav).lower())
+                elif iop is sre_parse.RANGE:
+                    inside |= {c for c in RISK_SAMPLE if iav[0] <= ord(c) <= iav[1] or iav[0] <= ord(c.upper()) <= iav[1]}
+                elif iop is sre_parse.CATEGORY and iav in RISK_CATEGORIES:
+                    inside |= {c for c in RISK_SAMPLE if re.match(RISK_CATEGORIES[iav], c)}
+                else:
+                    inside |= RISK_SAMPLE
+            chars |= (RISK_SAMPLE - inside) if negate else inside
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            chars |= char_set(av[2])
+        elif op is sre_parse.SUBPATTERN:
+            chars |= char_set(av[-1])
+        elif op is sre_parse.BRANCH:
+            for branch in av[1]:
+                chars |= char_set(branch)
+    return chars
+
+def scan_repeats(items, open_sets):
+    """
+    Find unbounded repeats in a row that compete for the same characters
+    (\w+\w+, a*a*b, .*a.*b): each extra one multiplies the ways to split a
+    message, so a failing search on 512 chars can take seconds or minutes.
+    open_sets are the character sets of earlier unbounded repeats that could
+    still take over what comes next. Returns (reason or None, open_sets).
+    """
+    for op, av in items:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            lo, hi, sub = av
+            chars = char_set(sub)
+            if hi == sre_parse.MAXREPEAT or hi >= RISKY_REPEAT_MIN:
+                if any(chars & prev for prev in open_sets):
+                    return "repeats competing for the same text, e.g. \\w+\\w+ or .*a.*b", open_sets
+                reason = scan_repeats(sub, [])[0]
+                if reason:
+                    return reason, open_sets
+                if lo:
+                    open_sets = [prev for prev in open_sets if chars <= prev]
+                open_sets = open_sets + [chars]
+            else:
+                reason = scan_repeats(sub, [])[0]
+                if reason:
+                    return reason, open_sets
+                if lo:
+                    open_sets = [prev for prev in open_sets if chars <= prev]
+        elif op is sre_parse.SUBPATTERN:
+            reason, open_sets = scan_repeats(av[-1], open_sets)
+            if reason:
+                return reason, open_sets
+        elif op is sre_parse.BRANCH:
+            merged = []
+            for branch in av[1]:
+                reason, after = scan_repeats(branch, open_sets)
+                if reason:
+                    return reason, open_sets
+                merged.extend(after)
+            open_sets = merged
+        elif op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            chars = char_set([(op, av)])
+            open_sets = [prev for prev in open_sets if chars <= prev]
+    return None, open_sets
+
+def branch_head(items):
+    """First literal character an alternative starts with: '' if it can be empty, None if not a plain literal."""
+    if not items:
+        return ""
+    op, av = items[0]
+    if op is sre_parse.LITERAL:
+        return chr(av).lower()
+    if op is sre_parse.SUBPATTERN:
+        return branch_head(av[-1])
+    return None
+
+def rule_risk(pat, cre, is_wild):
+    """regex_risk() for rules that really run as a regex (not wildcard or escaped-literal rules)."""
+    if is_wild or cre.pattern != pat or not REGEX_META & set(pat):
+        return None
+    return regex_risk(pat)
+
+def compile_rule_line(line):
+    """Parse and compile one 'pattern :: message :: minutes :: options' line -> (pattern, rule) or None."""
+    parsed = parse_rule_line(line)
+    if not parsed:
+        return None
+    pat, msg, dur, opts = parsed
+    is_wildcard = "*" in pat
+    cre, is_wild = pattern_to_regex(pat, is_new_rule=is_wildcard)
+    if cre is None:
+        log(f"Invalid pattern skipped: {pat}")
+        return None
+    risk = rule_risk(pat, cre, is_wild)
+    if risk:
+        log(f"Unsafe pattern skipped: {pat} ({risk})", rule=pat)
+        return None
+    return pat, (cre, msg, dur, is_wild, opts)
+
+def format_rule_line(pat, msg, dur, opts=()):
+    if opts:
+        return f"{pat} :: {msg} :: {'' if dur is None else dur} :: {','.join(opts)}"
+    if dur is None:
+        return f"{pat} :: {msg}"
+    return f"{pat} :: {msg} :: {dur}"
+
+def load_rules_from_file(filename, memo=None):
+    """
+    Parse filename plus its journal into a rules dict. memo maps rule lines to
+    their compiled result from the previous load: unchanged lines are reused
+    and the dict is refreshed with the lines seen this time.
+    """
     rules = {}
     if not os.path.exists(filename):
         return rules
+    old = dict(memo) if memo is not None else {}
+    if memo is not None:
+        memo.clear()
+
+    def compiled_line(line):
+        if line in old:
+            compiled = old[line]
+        else:
+            compiled = compile_rule_line(line)
+        if memo is not None:
+            memo[line] = compiled
+        return compiled
+
     try:
         with open(filename, "r", encoding="utf-8") as fh:
             for raw in fh:
                 line = raw.strip()
                 if not line or line.startswith("#"):
                     continue
-                parsed = parse_rule_line(line)
-                if not parsed:
-                    continue
-                pat, msg, dur = parsed
-                is_wildcard = "*" in pat
-                cre, is_wild = pattern_to_regex(pat, is_new_rule=is_wildcard)
-                if cre is None:
-                    log(f"Invalid pattern skipped: {pat}")
-                    continue
-                rules[pat] = (cre, msg, dur, is_wild)
+                compiled = compiled_line(line)
+                if compiled:
+                    add_loaded_rule(rules, compiled)
+        for op, text in read_journal(filename):
+            if op == "+":
+                compiled = compiled_line(text)
+                if compiled:
+                    add_loaded_rule(rules, compiled)
+            else:
+                rules.pop(text, None)
     except Exception as e:
         log(f"Error loading {filename}: {e}")
     return rules
 
+def write_atomic(filename, lines):
+    """Write lines to a temp file and rename it over filename."""
+    tmp = filename + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        for line in lines:
+            fh.write(line + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, filename)
+    mark_seen(filename)
+
 def save_rules_to_file(rules, filename):
     try:
-        with open(filename, "w", encoding="utf-8") as fh:
-            for pat, (_, msg, dur, _) in rules.items():
-                if dur is None:
-                    fh.write(f"{pat} :: {msg}\n")
-                else:
-                    fh.write(f"{pat} :: {msg} :: {dur}\n")
+        write_atomic(filename, (format_rule_line(pat, msg, dur, opts) for pat, (_, msg, dur, _, opts) in rules.items()))
         log(f"Saved {len(rules)} rules to {os.path.basename(filename)}")
     except Exception as e:
         log(f"Error saving rules: {e}")
 
+# -------------------------
+# Rule / exempt journals
+# -------------------------
+JOURNAL_COMPACT_BYTES = 64 * 1024
+JOURNAL_COMPACT_DELAY_MS = 5000
+compact_pending = set()
+
+def journal_path(filename):
+    return filename + ".journal"
+
+def read_journal(filename):
+    """Yield (op, text) from filename's journal: '+ <line>' adds, '- <key>' deletes."""
+    path = journal_path(filename)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as fh:
+        for raw in fh:
+            line = raw.rstrip("\n")
+            if len(line) > 2 and line[0] in "+-" and line[1] == " ":
+                yield line[0], line[2:].strip()
+
+def append_journal(filename, op, text):
+    """Record one add/delete for filename: O(1) I/O instead of a full rewrite."""
+    path = journal_path(filename)
+    try:
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write(f"{op} {text}\n")
+        mark_seen(path)
+        if os.path.getsize(path) > JOURNAL_COMPACT_BYTES:
+            schedule_compaction(filename)
+    except Exception as e:
+        log(f"Error writing journal {os.path.basename(path)}: {e}")
+
+def schedule_compaction(filename):
+    if filename in compact_pending:
+        return
+    compact_pending.add(filename)
+
+    def run(userdata=None):
+        compact_pending.discard(filename)
+        compact_journal(filename)
+        return False
+    hexchat.hook_timer(JOURNAL_COMPACT_DELAY_MS, run)
+
+def compact_journal(filename):
+    """Fold the journal into the base file (atomic rename), then drop the journal."""
+    try:
+        rs = ruleset
+        if filename == BAD_NICKS_FILE:
+            save_rules_to_file(rs.nick_rules, filename)
+        elif filename == BAD_WORDS_FILE:
+            save_rules_to_file(rs.word_rules, filename)
+        elif filename == EXEMPT_FILE:
+            save_exempt_list(rs.exempt)
+        else:
+            return
+        os.remove(journal_path(filename))
+        log(f"Compacted {os.path.basename(journal_path(filename))}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log(f"Error compacting journal for {os.path.basename(filename)}: {e}")
+
+# -------------------------
+# Compiled-rule cache
+# -------------------------
+RULE_CACHE_VERSION = 7
+
+class LazyRegex(object):
+    """Stands in for a compiled rule regex restored from the cache; compiles on first use."""
+    __slots__ = ("pattern", "_cre")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._cre = None
+
+    def compiled(self):
+        if self._cre is None:
+            self._cre = re.compile(self.pattern, re.IGNORECASE)
+        return self._cre
+
+    def search(self, *args):
+        return self.compiled().search(*args)
+
+def file_signature(filename):
+    """[size, mtime_ns, sha1] of a rule file and its journal (None when missing)."""
+    sig = []
+    for path in (filename, journal_path(filename)):
+        try:
+            st = os.stat(path)
+            with open(path, "rb") as fh:
+                digest = hashlib.sha1(fh.read()).hexdigest()
+            sig.append([st.st_size, st.st_mtime_ns, digest])
+        except OSError:
+            sig.append(None)
+    return sig
+
+def read_rule_cache():
+    try:
+        with open(RULE_CACHE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == RULE_CACHE_VERSION:
+            return data.get("files", {})
+    except Exception:
+        pass
+    return {}
+
+def write_rule_cache(files):
+    try:
+        tmp = RULE_CACHE_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": RULE_CACHE_VERSION, "files": files}, f)
+        os.replace(tmp, RULE_CACHE_FILE)
+    except Exception as e:
+        log(f"Error writing rule cache: {e}")
+
+def load_rule_table(filename, cache, memo=None):
+    """
+    Rules for filename, from the cache when size/mtime/hash of the file and its
+    journal still match (no parsing or validation), else parsed from disk.
+    memo is filled with line -> compiled rule for later hot reloads.
+    Returns (rules, cache_entry, was_cached).
+    """
+    name = os.path.basename(filename)
+    sig = file_signature(filename)
+    entry = cache.get(name)
+    if entry and entry.get("sig") == sig:
+        rules = {}
+        for pat, msg, dur, is_wild, src, opts in entry["rules"]:
+            rules[pat] = (WildcardPattern(pat) if is_wild else LazyRegex(src), msg, dur, is_wild, tuple(opts))
+            if memo is not None:
+                memo[format_rule_line(pat, msg, dur, rules[pat][4])] = (pat, rules[pat])
+        return rules, entry, True
+    rules = load_rules_from_file(filename, memo)
+    entry = {
+        "sig": sig,
+        "rules": [[pat, msg, dur, is_wild, cre.pattern, list(opts)] for pat, (cre, msg, dur, is_wild, opts) in rules.items()],
+    }
+    return rules, entry, False
+
+# -------------------------
+# Text normalization (rules with the 'norm' option)
+# -------------------------
+# mIRC bold/color/italic/underline/reverse/reset codes, incl. color arguments
+FORMAT_CODES_RE = re.compile(r"\x03(?:\d{1,2}(?:,\d{1,2})?)?|\x04(?:[0-9a-fA-F]{6}(?:,[0-9a-fA-F]{6})?)?|[\x02\x0f\x11\x16\x1d\x1e\x1f]")
+ZERO_WIDTH = "\u00ad\u180e\u200b\u200c\u200d\u200e\u200f\u2060\u2061\u2062\u2063\u2064\ufeff"
+CONFUSABLES = {
+    # Cyrillic / Greek look-alikes -> Latin
+    "аАα": "a", "вВβ": "b", "сСϲ": "c", "еЕεЁё": "e", "нН": "h", "іІιΙ": "i", "јЈ": "j",
+    "кКκΚ": "k", "мМΜ": "m", "пη": "n", "оОοΟ": "o", "рРρΡ": "p", "ѕЅ": "s", "тТτΤ": "t",
+    "уУ": "y", "хХχΧ": "x", "ԁ": "d", "ԛ": "q", "ԝ": "w", "Ζᴢ": "z", "ν": "v",
+    "ԍɡ": "g", "ӏⅼ": "l", "υս": "u",
+}
+LEET = {"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "9": "g",
+        "@": "a", "$": "s", "!": "i", "|": "l", "+": "t", "€": "e", "£": "l"}
+
+def build_normalize_table():
+    """One str.translate table: zero-width chars dropped, fullwidth/confusable/leet folded to ASCII letters."""
+    table = {ord(ch): None for ch in ZERO_WIDTH}
+    for code in range(0xFF01, 0xFF5F):   # fullwidth ASCII block
+        ascii_ch = chr(code - 0xFEE0)
+        table[code] = LEET.get(ascii_ch, ascii_ch)
+    for chars, latin in CONFUSABLES.items():
+        for ch in chars:
+            table[ord(ch)] = latin
+    for ch, latin in LEET.items():
+        table[ord(ch)] = latin
+    return table
+
+NORMALIZE_TABLE = build_normalize_table()
+
+def normalize_text(text):
+    """Formatting codes stripped, then confusables/leet folded (one regex pass + one translate)."""
+    return FORMAT_CODES_RE.sub("", text).translate(NORMALIZE_TABLE)
+
+# -------------------------
+# Compiled word engine
+# -------------------------
+REGEX_META = set(".^$*+?{}[]\\|()")
+LITERAL_BUCKET_SIZE = 1024   # literals per trie bucket (bucket count rounds up to a power of two)
+LITERAL_MEMO_MAX = 256       # compiled buckets kept for reuse across reloads
+literal_bucket_memo = OrderedDict()   # frozenset(literals) -> compiled trie regex
+
+def trie_regex(words):
+    """Build one regex source matching any of words, factored as a prefix trie."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = None
+
+    def walk(node):
+        if "" in node and len(node) == 1:
+            return None
+        alts = []
+        chars = []
+        for ch in sorted(k for k in node if k):
+            sub = walk(node[ch])
+            if sub is None:
+                chars.append(re.escape(ch))
+            else:
+                alts.append(re.escape(ch) + sub)
+        if chars:
+            alts.append(chars[0] if len(chars) == 1 else "[" + "".join(chars) + "]")
+        src = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            src = "(?:" + src + ")?"
+        return src
+
+    return walk(trie) if trie else None
+
+def compile_rule_engine(rules, sources=None, order_of=None):
+    """
+    Compile a rules dict into one matching engine (see match_rules):
+    - literal and *word* rules go into trie regexes, hash-bucketed so a reload
+      only rebuilds the buckets whose literals changed (see literal_buckets)
+    - wildcard rules with inner '*' run on WildcardPattern (ordered substring search)
+    - raw-regex rules stay as a fallback list, checked in file order
+    - rules with the 'norm' option get a second pass of the same shape (engine["norm"])
+      that runs against normalize_text(message), their patterns normalized alike
+    sources: regex sources from the rule cache for these same rules (skips the trie build)
+    order_of: pattern -> position in the whole rule file, so the first rule in
+    file order wins across passes and engines (see compile_scoped_engine)
+    """
+    if order_of is None:
+        order_of = {pat: i for i, pat in enumerate(rules)}
+    plain, norm = {}, {}
+    for pat, rule in rules.items():
+        (norm if "norm" in rule[4] else plain)[pat] = rule
+    engine = compile_rule_pass(plain, sources, order_of=order_of)
+    engine["norm"] = compile_rule_pass(norm, (sources or {}).get("norm"), normalized=True, order_of=order_of) if norm else None
+    if engine["sources"] is not None and engine["norm"] is not None:
+        engine["sources"] = dict(engine["sources"], norm=engine["norm"]["sources"])
+    return engine
+
+def literal_buckets(literals):
+    """
+    Split literals into buckets by a crc32 of their first character (stable across
+    runs, so cached sources line up). Each bucket's trie then starts with a small
+    character set, which lets re skip message positions no literal in it can start at.
+    """
+    count = 1
+    while count * LITERAL_BUCKET_SIZE < len(literals):
+        count *= 2
+    buckets = [[] for _ in range(count)]
+    for lit in literals:
+        buckets[zlib.crc32(lit[0].encode("utf-8")) % count].append(lit)
+    return [frozenset(b) for b in buckets if b]
+
+def compile_literal_bucket(bucket, source=None):
+    """Compiled trie regex for one bucket, reused when the same literal set was compiled before."""
+    cre = literal_bucket_memo.get(bucket)
+    if cre is not None:
+        literal_bucket_memo.move_to_end(bucket)
+        return cre
+    cre = re.compile(source or trie_regex(bucket), re.IGNORECASE)
+    literal_bucket_memo[bucket] = cre
+    if len(literal_bucket_memo) > LITERAL_MEMO_MAX:
+        literal_bucket_memo.popitem(last=False)
+    return cre
+
+def compile_rule_pass(rules, sources=None, normalized=False, order_of=None):
+    literals = {}   # lowered literal -> (order, pattern), first rule in file order
+    wild = []       # (order, pattern, WildcardPattern), in file order
+    regex = []      # (order, pattern, compiled_re), in file order
+    fold = normalize_text if normalized else (lambda text: text)
+    for order, (pat, (cre, msg, dur, is_wild, opts)) in enumerate(rules.items()):
+        if order_of is not None:
+            order = order_of[pat]
+        if is_wild:
+            core = pat.strip("*")
+            if core and "*" not in core:
+                literals.setdefault(fold(core).lower(), (order, pat))
+            else:
+                wild.append((order, pat, WildcardPattern(fold(pat)) if normalized else cre))
+        elif pat and (cre.pattern == re.escape(pat) or not REGEX_META & set(pat)):
+            literals.setdefault(fold(pat).lower(), (order, pat))
+        else:
+            regex.append((order, pat, cre))
+
+    engine = {"literal_res": [], "literals": literals, "lengths": sorted(set(len(lit) for lit in literals)),
+              "wild": wild, "regex": regex, "label": "normalized " if normalized else ""}
+    try:
+        buckets = literal_buckets(literals)
+        cached = (sources or {}).get("literal")
+        if not isinstance(cached, list) or len(cached) != len(buckets):
+            cached = [None] * len(buckets)
+        engine["literal_res"] = [compile_literal_bucket(b, src) for b, src in zip(buckets, cached)]
+        engine["sources"] = {"literal": [cre.pattern for cre in engine["literal_res"]]}
+    except Exception as e:
+        # fall back to checking every rule on its own
+        log(f"Error compiling rule engine: {e}")
+        engine["literal_res"] = []
+        engine["literals"] = {}
+        engine["lengths"] = []
+        engine["wild"] = []
+        engine["regex"] = [(order_of[pat] if order_of is not None else i, pat, rule[0]) for i, (pat, rule) in enumerate(rules.items())]
+        engine["sources"] = None
+    return engine
+
+def match_rules(engines, text, kind="word"):
+    """
+    Return the pattern of the rule that fires for text, or None: of every rule
+    in engines (see scoped_engines) that matches, the first in file order.
+    """
+    best = None
+    normalized = None
+    for engine in engines:
+        found = match_rule_pass(engine, text, kind, best)
+        if found is not None:
+            best = found
+        if engine["norm"] is not None:
+            if normalized is None:
+                normalized = normalize_text(text)
+            found = match_rule_pass(engine["norm"], normalized, kind, best)
+            if found is not None:
+                best = found
+    if best is None:
+        return None
+    if stats_enabled:
+        record_rule(kind, best[1], hit=True)
+    return best[1]
+
+def match_rule_pass(engine, text, kind, best=None):
+    """(order, pattern) of the first rule in file order that matches text, if it comes before best."""
+    limit = best[0] if best is not None else None
+    found = None
+    if engine["literal_res"]:
+        t0 = time.perf_counter_ns() if stats_enabled else 0
+        m = None
+        for literal_re in engine["literal_res"]:
+            hit = literal_re.search(text)
+            if hit and (m is None or hit.start() < m.start()):
+                m = hit
+        if m:
+            literals = engine["literals"]
+            hit = m.group(0).lower()
+            found = literals.get(hit)
+            if found is None:
+                # case-folding mismatch (rare): find the literal the hit stands for
+                for lit, rule in literals.items():
+                    if re.fullmatch(re.escape(lit), hit, re.IGNORECASE):
+                        found = rule
+                        break
+            # the trie reports one literal; any other in the text may come earlier in the file
+            lowered = text.lower()
+            start = m.start() if len(lowered) == len(text) else 0
+            for i in range(start, len(lowered)):
+                for ln in engine["lengths"]:
+                    if i + ln > len(lowered):
+                        break
+                    rule = literals.get(lowered[i:i + ln])
+                    if rule is not None and (found is None or rule[0] < found[0]):
+                        found = rule
+            if found is not None and limit is not None and found[0] >= limit:
+                found = None
+            if found is not None:
+                limit = found[0]
+        if stats_enabled:
+            record_rule(kind, f"({engine['label']}literal trie)", time.perf_counter_ns() - t0)
+    if engine["wild"]:
+        t0 = time.perf_counter_ns() if stats_enabled else 0
+        lowered = text.lower()
+        for order, p, matcher in engine["wild"]:
+            if limit is not None and order >= limit:
+                break
+            if matcher.search(lowered, True):
+                found = (order, p)
+                limit = order
+                break
+        if stats_enabled:
+            record_rule(kind, f"({engine['label']}wildcard rules)", time.perf_counter_ns() - t0)
+    for order, p, cre in engine["regex"]:
+        if limit is not None and order >= limit:
+            break
+        t0 = time.perf_counter_ns() if stats_enabled else 0
+        try:
+            hit = cre.search(text)
+        except Exception as e:
+            log(f"Error checking rule '{p}': {e}")
+            hit = None
+        if stats_enabled:
+            record_rule(kind, p, time.perf_counter_ns() - t0)
+        if hit:
+            found = (order, p)
+            break
+    return found
+
+# -------------------------
+# Compiled nick engine
+# -------------------------
+def wildcard_core(pat):
+    """Nick a wildcard rule is built around; exact matches of it are not banned."""
+    core = re.sub(r"\s+", "", pat)
+    core = re.sub(r"\*+", "*", core)
+    return core.replace("*", "").strip().lower()
+
+# Nick rules starting with 'host:', 'real:' or 'account:' match a joiner's
+# WHOX data ('host:*.badisp.net', 'real:*casino*', 'account:spammer') instead
+# of the nick; they are indexed per field in the same engine.
+IDENTITY_FIELDS = ("host", "real", "account")
+
+def rule_field(pat):
+    field, sep, _ = pat.partition(":")
+    return field.lower() if sep and field.lower() in IDENTITY_FIELDS else "nick"
+
+def compile_nick_engine(rules, order_of=None):
+    """
+    Index nick rules for on_join, one index per field ('nick', 'host', ...):
+    - literal and wildcard rules are filed under their longest literal fragment,
+      so a join only verifies rules whose fragment occurs in the nick
+    - wildcard rules carry their precomputed core for the exact-match exemption
+    - raw-regex rules (and bare '*') are verified on every join
+    order_of: pattern -> position in the whole rule file, so candidates from
+    several engines (see compile_scoped_engine) still sort into file order
+    """
+    fields = {}     # field -> {"index": lowered fragment -> [(order, pattern, core)], "regex": [(order, pattern, None)]}
+    for order, (pat, (cre, msg, dur, is_wild, opts)) in enumerate(rules.items()):
+        if order_of is not None:
+            order = order_of[pat]
+        sub = fields.setdefault(rule_field(pat), {"index": {}, "regex": []})
+        index, regex = sub["index"], sub["regex"]
+        if is_wild:
+            frags = [f for f in pat.split("*") if f]
+            if frags:
+                frag = max(frags, key=len).lower()
+                index.setdefault(frag, []).append((order, pat, wildcard_core(pat)))
+            else:
+                regex.append((order, pat, None))
+        elif pat and (cre.pattern == re.escape(pat) or not REGEX_META & set(pat)):
+            index.setdefault(pat.lower(), []).append((order, pat, None))
+        else:
+            regex.append((order, pat, None))
+    for sub in fields.values():
+        sub["lengths"] = sorted(set(len(f) for f in sub["index"]))
+    return fields
+
+def nick_rule_candidates(engine, nick_l, field="nick"):
+    """Rules of field that could match nick_l, in rule file order."""
+    sub = engine.get(field)
+    if sub is None:
+        return []
+    index = sub["index"]
+    found = list(sub["regex"])
+    n = len(nick_l)
+    for ln in sub["lengths"]:
+        if ln > n:
+            break
+        for i in range(n - ln + 1):
+            hits = index.get(nick_l[i:i + ln])
+            if hits:
+                found.extend(hits)
+    found.sort()
+    return found
+
+# -------------------------
+# Channel-scoped engines
+# -------------------------
+# Options starting with '#' or '&' scope a rule to matching channels
+# ('#help', '#game-*'); rules without one apply everywhere.
+CHANNEL_PREFIXES = "#&"
+
+def rule_scopes(opts):
+    return [o for o in opts if o[:1] in CHANNEL_PREFIXES]
+
+def rule_conflict(rules, pat, rule):
+    """
+    Warning when rule would replace a rule for the same pattern scoped to other
+    channels (rules are keyed by pattern alone), else None.
+    """
+    old = rules.get(pat)
+    if old is None or set(rule_scopes(old[4])) == set(rule_scopes(rule[4])):
+        return None
+    label = lambda opts: " ".join(rule_scopes(opts)) or "all channels"
+    return (f"Rule '{pat}' for {label(rule[4])} replaces the one for {label(old[4])} — "
+            f"one rule per pattern, so give each channel's rule its own pattern")
+
+def add_loaded_rule(rules, compiled):
+    """rules[pattern] = rule for a rule read from a file or the store, logging scope conflicts."""
+    pat, rule = compiled
+    conflict = rule_conflict(rules, pat, rule)
+    if conflict:
+        log(conflict, rule=pat)
+    rules[pat] = rule
+
+def compile_scoped_engine(rules, compile_fn, sources=None):
+    """
+    Split rules by channel scope and compile one engine per scope plus one
+    global engine with compile_fn(rules, sources). Per-channel engine lists
+    are resolved on first use (see scoped_engines).
+    """
+    groups = {}     # scope -> rules dict, None = global
+    for pat, rule in rules.items():
+        for scope in rule_scopes(rule[4]) or [None]:
+            groups.setdefault(scope, {})[pat] = rule
+    sources = sources or {}
+    scoped = {
+        "global": compile_fn(groups.pop(None, {}), sources.get("global")),
+        "scoped": {scope: compile_fn(group, sources.get("scoped", {}).get(scope)) for scope, group in groups.items()},
+        "channels": {},     # channel (lowercase) -> [engine, ...]; memo, filled per snapshot
+    }
+    scoped["sources"] = {
+        "global": scoped["global"].get("sources"),
+        "scoped": {scope: eng.get("sources") for scope, eng in scoped["scoped"].items()},
+    }
+    return scoped
+
+def scoped_engines(scoped, channel):
+    """Engines that apply in channel: the global one, then every scope matching it."""
+    chan = (channel or "").lower()
+    engines = scoped["channels"].get(chan)
+    if engines is None:
+        engines = [scoped["global"]]
+        for scope, engine in scoped["scoped"].items():
+            if scope == chan or (chan and fnmatch.fnmatchcase(chan, scope)):
+                engines.append(engine)
+        scoped["channels"][chan] = engines
+    return engines
+
 # -------------------------
 # Load protected channels from file
 # -------------------------
 def load_protected_channels(reset=False):
-    """Load protected channels from file into memory."""
-    global protected_channels
-    protected_channels = set()
+    """Load protected channels from file."""
+    channels = set()
     if reset and os.path.exists(PROTECTED_FILE):
         try:
             os.remove(PROTECTED_FILE)
@@ -258,26 +1158,31 @@ def load_protected_channels(reset=False):
                     s = line.strip()
                     # allow lines that start with '#' (channel names)
                     if s and not s.startswith("# "):  # skip commented lines only
-                        protected_channels.add(s.lower())
-            log(f"Loaded {len(protected_channels)} protected channels: {', '.join(protected_channels) or '<none>'}")
+                        channels.add(" ".join(s.lower().split()))
+            log(f"Loaded {len(channels)} protected channels: {', '.join(channels) or '<none>'}")
         except Exception as e:
             log(f"Error loading protected channels: {e}")
     else:
         log("No protected_channels.txt found — creating a new one.")
-        save_protected_channels()
+        save_protected_channels(channels)
+    return frozenset(channels)
 
 
 # -------------------------
 # Save protected channels to file
 # -------------------------
-def save_protected_channels():
-    """Save the protected channels list to PROTECTED_FILE."""
+def save_protected_channels(channels):
+    """Save the protected channels list to PROTECTED_FILE (or the store when enabled)."""
+    if store_db is not None:
+        store_save_channels(channels)
+        return
     try:
         with open(PROTECTED_FILE, "w", encoding="utf-8") as f:
-            f.write("# protected_channels.txt - one channel per line (lowercase)\n")
-            for channel in sorted(protected_channels):
+            f.write("# protected_channels.txt - one channel per line (lowercase), '#chan' or 'network #chan'\n")
+            for channel in sorted(channels):
                 f.write(f"{channel}\n")
-        log(f"Saved {len(protected_channels)} protected channels.")
+        mark_seen(PROTECTED_FILE)
+        log(f"Saved {len(channels)} protected channels.")
     except Exception as e:
         log(f"Error saving protected channels: {e}")
 
@@ -285,16 +1190,20 @@ def save_protected_channels():
 # Exempt list helpers
 # -------------------------
 def load_exempt_list():
-    global exempt_set
-    exempt_set = set()
+    entries = set()
     if os.path.exists(EXEMPT_FILE):
         try:
             with open(EXEMPT_FILE, "r", encoding="utf-8") as fh:
                 for raw in fh:
                     s = raw.strip()
                     if s and not s.startswith("#"):
-                        exempt_set.add(s)
-            log(f"Loaded exempt list ({len(exempt_set)} entries).")
+                        entries.add(s)
+            for op, entry in read_journal(EXEMPT_FILE):
+                if op == "+":
+                    entries.add(entry)
+                else:
+                    entries.discard(entry)
+            log(f"Loaded exempt list ({len(entries)} entries).")
         except Exception as e:
             log(f"Error loading exempt list: {e}")
     else:
@@ -305,117 +1214,1049 @@ def load_exempt_list():
             log("Created exempt.txt")
         except Exception as e:
             log(f"Error creating exempt file: {e}")
+    return frozenset(entries)
 
-def save_exempt_list():
+def save_exempt_list(entries):
     try:
-        with open(EXEMPT_FILE, "w", encoding="utf-8") as fh:
-            fh.write("# exempt.txt - one nick or mask per line\n")
-            for e in sorted(exempt_set):
-                fh.write(e + "\n")
-        log(f"Saved exempt list ({len(exempt_set)} entries).")
+        write_atomic(EXEMPT_FILE, ["# exempt.txt - one nick or mask per line"] + sorted(entries))
+        log(f"Saved exempt list ({len(entries)} entries).")
     except Exception as e:
         log(f"Error saving exempt list: {e}")
 
-def get_user_host(nick):
-    """Return ident@host if found via userlist, else None"""
+# -------------------------
+# Network/channel keys & context cache
+# -------------------------
+# Per-channel state is keyed by (network, channel), both lowercase, so two
+# networks sharing a channel name never mix. The context an event fired in is
+# remembered per key; actions for that key are sent there without a lookup.
+channel_contexts = {}   # (network, chan_lower) -> hexchat context
+
+def network_of(ctx=None):
+    src = ctx if ctx is not None else hexchat
     try:
-        users = hexchat.get_list("users")
-        if not users:
-            return None
-        for u in users:
-            if u.nick and u.nick.lower() == nick.lower():
-                # u.host usually is "ident@hostname"
-                return u.host  # may be None
+        return (src.get_info("network") or src.get_info("server") or "").lower()
+    except Exception:
+        return ""
+
+def chan_key(channel, network=None):
+    """(network, channel) key; network defaults to the current context's."""
+    return (network if network is not None else network_of(), channel.lower())
+
+def remember_context(key):
+    """Called from event hooks: the current context is the event's own."""
+    if key not in channel_contexts:
+        channel_contexts[key] = hexchat.get_context()
+
+def find_channel_context(network, channel):
+    try:
+        for ch in hexchat.get_list("channels") or []:
+            if ch.channel.lower() == channel.lower() and network_of(ch.context) == network:
+                return ch.context
     except Exception:
         pass
     return None
 
-def is_exempt(nick):
+def context_for(key):
+    """Context for key: cached, else looked up once in the channel list (None if not joined)."""
+    ctx = channel_contexts.get(key)
+    if ctx is None:
+        ctx = find_channel_context(*key)
+        if ctx is not None:
+            channel_contexts[key] = ctx
+    return ctx
+
+def forget_channel(key):
+    channel_contexts.pop(key, None)
+    drop_host_index(key)
+    ban_lists.pop(key, None)
+
+def on_disconnected(word, word_eol, userdata):
+    network = network_of()
+    for key in [k for k in channel_contexts if k[0] == network]:
+        del channel_contexts[key]
+    for key in [k for k in host_index if k[0] == network]:
+        drop_host_index(key)
+    for key in [k for k in ban_lists if k[0] == network]:
+        del ban_lists[key]
+    for pkey in [k for k in pending_actions if k[0] == network]:
+        del pending_actions[pkey]
+    drop_queued_actions(network)
+    forget_who(network)
+    return hexchat.EAT_NONE
+
+# -------------------------
+# Nick -> host index
+# -------------------------
+host_index = {}       # (network, chan_lower) -> {nick_lower: "ident@host" or None}
+host_seeded = {}      # (network, chan_lower) -> time of last userlist seed; dropped on resync events
+
+def seed_host_index(key):
     """
-    Exempt logic (Option B):
-    - if exempt entry contains '@' or '!' treat as a mask and match against 'nick!ident@host' or '*!*@host'
-    - if entry looks like plain nick (no '*' and no '@'), compare lower-case equality
-    - wildcard entries (with *) are matched with fnmatch against mask string (nick!ident@host) and also nick
+    Merge the HexChat userlist into one channel's nick -> host index. Entries
+    already there (joiners indexed before the seed) are kept; a known host is
+    never replaced by the userlist's None.
     """
-    if not exempt_set:
+    users = None
+    try:
+        ctx = context_for(key)
+        users = ctx.get_list("users") if ctx else hexchat.get_list("users")
+    except Exception:
+        pass
+    index = host_index.setdefault(key, {})
+    for u in users or []:
+        if u.nick and (u.host or u.nick.lower() not in index):
+            index[u.nick.lower()] = u.host
+    host_seeded[key] = time.time()
+    return index
+
+def resync_host_index(key):
+    """The channel's userlist changed wholesale (NAMES/WHO done): merge it in on the next lookup."""
+    host_seeded.pop(key, None)
+
+def drop_host_index(key):
+    host_index.pop(key, None)
+    host_seeded.pop(key, None)
+
+@instrumented("get_user_host")
+def get_user_host(nick, channel=None, key=None):
+    """Return ident@host from the channel's host index, else None"""
+    try:
+        if key is None:
+            if channel is None:
+                channel = hexchat.get_info("channel")
+            if not channel:
+                return None
+            key = chan_key(channel)
+        nick_l = nick.lower()
+        users = host_index.get(key)
+        if users is None or key not in host_seeded:
+            users = seed_host_index(key)
+        host = users.get(nick_l)
+        if host is None:
+            info = who_lookup(key[0], nick_l)
+            if info is not None:
+                host = f"{info[0]}@{info[1]}"
+        return host
+    except Exception:
+        pass
+    return None
+
+def index_on_join(word, word_eol, userdata):
+    # the channel's entry may not exist yet (just joined, after /AUTORELOAD): the
+    # joiner goes in anyway and the userlist is merged around it on first lookup
+    if len(word) >= 2:
+        users = host_index.setdefault(chan_key(word[1]), {})
+        users[word[0].lower()] = word[2] if len(word) >= 3 and word[2] else None
+    return hexchat.EAT_NONE
+
+def index_on_part(word, word_eol, userdata):
+    if len(word) >= 3:
+        host_index.get(chan_key(word[2]), {}).pop(word[0].lower(), None)
+    return hexchat.EAT_NONE
+
+def index_on_kick(word, word_eol, userdata):
+    if len(word) >= 3:
+        host_index.get(chan_key(word[2]), {}).pop(word[1].lower(), None)
+    return hexchat.EAT_NONE
+
+def index_on_quit(word, word_eol, userdata):
+    if len(word) >= 1:
+        network = network_of()
+        nick_l = word[0].lower()
+        for key, users in host_index.items():
+            if key[0] == network:
+                users.pop(nick_l, None)
+    return hexchat.EAT_NONE
+
+def index_on_nick_change(word, word_eol, userdata):
+    if len(word) >= 2:
+        network = network_of()
+        old_l, new_l = word[0].lower(), word[1].lower()
+        for key, users in host_index.items():
+            if key[0] == network and old_l in users:
+                users[new_l] = users.pop(old_l)
+    return hexchat.EAT_NONE
+
+def index_on_you_join(word, word_eol, userdata):
+    # we (re)joined: the channel is seeded again on its first lookup
+    if len(word) >= 2:
+        forget_channel(chan_key(word[1]))
+    return hexchat.EAT_NONE
+
+def index_on_names_end(word, word_eol, userdata):
+    # 366: [server, 366, me, #chan, :End of /NAMES list.]
+    if len(word) >= 4:
+        resync_host_index(chan_key(word[3]))
+    return hexchat.EAT_NONE
+
+def index_on_you_leave(word, word_eol, userdata):
+    # You Part: [nick, host, channel]; You Kicked: [you, channel, kicker]
+    pos = 2 if userdata == "part" else 1
+    if len(word) > pos:
+        forget_channel(chan_key(word[pos]))
+    return hexchat.EAT_NONE
+
+EXEMPT_GRAM = 4     # glob entries are indexed under this many chars of their longest literal run
+
+def glob_fragments(glob):
+    """Literal runs of an fnmatch glob: text between '*', '?' and [...] classes."""
+    frags, cur, i, n = [], [], 0, len(glob)
+    while i < n:
+        ch = glob[i]
+        if ch in "*?":
+            frags.append("".join(cur))
+            cur = []
+        elif ch == "[":
+            j = i + 1
+            if j < n and glob[j] == "!":
+                j += 1
+            if j < n and glob[j] == "]":
+                j += 1
+            while j < n and glob[j] != "]":
+                j += 1
+            if j >= n:
+                cur.append(ch)      # unclosed '[' is a literal
+            else:
+                frags.append("".join(cur))
+                cur = []
+                i = j
+        else:
+            cur.append(ch)
+        i += 1
+    frags.append("".join(cur))
+    return [f for f in frags if f]
+
+def compile_exempt_matcher(entries):
+    """
+    Split exempt entries by how they are matched:
+    - plain nicks -> casefolded set
+    - *!*@host masks -> host set
+    - masks without wildcards (nick!ident@host, ident@host) -> exact set
+    - remaining globs -> compiled one by one and filed under EXEMPT_GRAM chars
+      of their longest literal run, so a check only tries the globs whose run
+      occurs in the nick/mask (globs without any literal are always tried)
+    """
+    nicks, hosts, exact = set(), set(), set()
+    index = {}      # casefolded gram -> [(compiled glob, with_star)]
+    always = []     # [(compiled glob, with_star)]
+    for e in entries:
+        entry = e.strip()
+        if not entry:
+            continue
+        is_mask = "@" in entry or "!" in entry
+        if not is_mask and "*" not in entry:
+            nicks.add(entry.casefold())
+        elif entry.startswith("*!*@") and not set(entry[4:]) & set("*?["):
+            hosts.add(entry[4:].casefold())
+        elif is_mask and not set(entry) & set("*?["):
+            exact.add(entry.casefold())
+        else:
+            # '*' globs match nick!ident@host or the nick; other mask globs
+            # ('?', '[..]') match nick!ident@host or ident@host
+            item = (re.compile(fnmatch.translate(entry), re.IGNORECASE), "*" in entry)
+            frags = glob_fragments(entry.casefold())
+            if frags:
+                index.setdefault(max(frags, key=len)[:EXEMPT_GRAM], []).append(item)
+            else:
+                always.append(item)
+
+    return {
+        "nicks": nicks,
+        "hosts": hosts,
+        "exact": exact,
+        "index": index,
+        "lengths": sorted(set(len(g) for g in index)),
+        "always": always,
+        "need_host": bool(hosts or exact or index or always),
+    }
+
+def exempt_glob_candidates(m, text):
+    """Globs whose indexed gram occurs in text (casefolded nick!ident@host, or the nick)."""
+    index = m["index"]
+    found = list(m["always"])
+    n = len(text)
+    for ln in m["lengths"]:
+        if ln > n:
+            break
+        for i in range(n - ln + 1):
+            hits = index.get(text[i:i + ln])
+            if hits:
+                found.extend(hits)
+    return found
+
+@instrumented("is_exempt")
+def is_exempt(nick, channel=None, rs=None, key=None):
+    """
+    Exempt logic (Option B), against the matcher compiled from the exempt list:
+    - plain nick entries compare case-insensitively
+    - wildcard entries match 'nick!ident@host' (or the nick alone)
+    - other mask entries match 'nick!ident@host' or 'ident@host'
+    The host is only looked up when at least one mask or glob entry exists.
+    """
+    rs = rs or ruleset
+    m = rs.exempt_matcher
+    if not rs.exempt or m is None:
+        return False
+
+    nick_f = nick.casefold()
+    if nick_f in m["nicks"]:
+        return True
+    if not m["need_host"]:
         return False
 
-    # direct nick whitelist (exact)
-    for e in exempt_set:
-        if "@" not in e and "!" not in e and "*" not in e:
-            if nick.lower() == e.lower():
+    hostpart = get_user_host(nick, channel, key)  # ident@host or None
+    hostpart_f = mask_f = None
+    if hostpart:
+        hostpart_f = hostpart.casefold()
+        if m["hosts"] and hostpart_f.split("@", 1)[-1] in m["hosts"]:
+            return True
+        mask_f = f"{nick}!{hostpart}".casefold()
+        if mask_f in m["exact"] or hostpart_f in m["exact"]:
+            return True
+    if not (m["index"] or m["always"]):
+        return False
+
+    # nick and ident@host are substrings of the mask, so its grams cover all three;
+    # if host not found, wildcard entries still match the plain nick
+    seen = set()
+    for cre, with_star in exempt_glob_candidates(m, mask_f or nick_f):
+        if id(cre) in seen:
+            continue
+        seen.add(id(cre))
+        if with_star:
+            if (mask_f and cre.match(mask_f)) or cre.match(nick_f):
                 return True
+        elif cre.match(mask_f or nick_f) or (hostpart_f and cre.match(hostpart_f)):
+            return True
+
+    return False
+
+# -------------------------
+# Random message helper
+# -------------------------
+MSG_POOL_CHECK_SECONDS = 30
+msg_pools = {}   # filepath -> [mtime, lines, last_checked]
+
+def refresh_msg_pool(filepath, now=None):
+    """(Re)load a kick-message file into memory if its mtime changed."""
+    if now is None:
+        now = time.time()
+    pool = msg_pools.get(filepath)
+    try:
+        mtime = os.stat(filepath).st_mtime
+    except OSError:
+        mtime = None
+    if pool is None or pool[0] != mtime:
+        lines = []
+        if mtime is not None:
+            try:
+                with open(filepath, "r", encoding="utf-8") as f:
+                    lines = [ln.strip() for ln in f if ln.strip() and not ln.strip().startswith("#")]
+            except Exception as e:
+                log(f"Error reading random messages from {filepath}: {e}")
+        pool = [mtime, lines, now]
+        msg_pools[filepath] = pool
+    else:
+        pool[2] = now
+    return pool
+
+def load_msg_pools():
+    msg_pools.clear()
+    for fp in (NICK_MSG_FILE, WORD_MSG_FILE, FLOOD_MSG_FILE):
+        refresh_msg_pool(fp)
+
+def get_random_msg(filepath, default_msg=""):
+    try:
+        now = time.time()
+        pool = msg_pools.get(filepath)
+        if pool is None or now - pool[2] >= MSG_POOL_CHECK_SECONDS:
+            pool = refresh_msg_pool(filepath, now)
+        if not pool[1]:
+            return default_msg
+        return random.choice(pool[1])
+    except Exception as e:
+        log(f"Error reading random message from {filepath}: {e}")
+        return default_msg
+
+# -------------------------
+# Load everything
+# -------------------------
+def publish_ruleset(base=None, word_sources=None, **parts):
+    """
+    Swap in a new RuleSet: `base` (default: the current one) with `parts`
+    replaced. Engines/matchers for replaced rule tables are compiled first,
+    so the swap itself is a single assignment.
+    """
+    global ruleset
+    if "nick_rules" in parts:
+        parts["nick_rules"] = MappingProxyType(dict(parts["nick_rules"]))
+        order_of = {pat: i for i, pat in enumerate(parts["nick_rules"])}
+        parts["nick_engine"] = compile_scoped_engine(parts["nick_rules"], lambda rules, sources: compile_nick_engine(rules, order_of))
+        parts["nick_engine"]["identity"] = any(rule_field(pat) != "nick" for pat in parts["nick_rules"])
+    if "word_rules" in parts:
+        parts["word_rules"] = MappingProxyType(dict(parts["word_rules"]))
+        word_order = {pat: i for i, pat in enumerate(parts["word_rules"])}
+        parts["word_engine"] = compile_scoped_engine(parts["word_rules"], lambda rules, sources: compile_rule_engine(rules, sources, word_order), word_sources)
+    if "exempt" in parts:
+        parts["exempt"] = frozenset(parts["exempt"])
+        parts["exempt_matcher"] = compile_exempt_matcher(parts["exempt"])
+    if "protected" in parts:
+        parts["protected"] = frozenset(parts["protected"])
+    ruleset = (base or ruleset)._replace(**parts)
+    return ruleset
+
+def load_all(reset=False):
+    ensure_files_exist(reset)
+    load_settings()
+    if use_store():
+        return load_all_from_store()
+    cache = {} if reset else read_rule_cache()
+    rule_line_memo.clear()
+    nick_rules, nick_entry, nick_cached = load_rule_table(BAD_NICKS_FILE, cache, rule_line_memo.setdefault(BAD_NICKS_FILE, {}))
+    word_rules, word_entry, word_cached = load_rule_table(BAD_WORDS_FILE, cache, rule_line_memo.setdefault(BAD_WORDS_FILE, {}))
+    empty = RuleSet(MappingProxyType({}), None, MappingProxyType({}), None, frozenset(), None, frozenset())
+    rs = publish_ruleset(
+        base=empty,
+        word_sources=word_entry.get("engine") if word_cached else None,
+        nick_rules=nick_rules,
+        word_rules=word_rules,
+        protected=load_protected_channels(reset),
+        exempt=load_exempt_list(),
+    )
+    if not (nick_cached and word_cached) or word_entry.get("engine") is None:
+        word_entry["engine"] = rs.word_engine.get("sources")
+        write_rule_cache({os.path.basename(BAD_NICKS_FILE): nick_entry, os.path.basename(BAD_WORDS_FILE): word_entry})
+    load_msg_pools()
+    for fp in watched_files():
+        mark_seen(fp)
+    log(f"Loaded {len(rs.nick_rules)} nick rules, {len(rs.word_rules)} word rules, {len(rs.protected)} protected channels."
+        + (" (from rule cache)" if nick_cached and word_cached else ""))
+    return nick_cached and word_cached
+
+# -------------------------
+# Hot reload (file watcher)
+# -------------------------
+WATCH_MS = 3000
+watch_mtimes = {}     # path -> mtime_ns last seen (or written by us)
+rule_line_memo = {}   # rule file -> {line: compiled result}, reused by hot reloads
+
+def watched_files():
+    if store_db is not None:
+        return [SETTINGS_FILE]
+    return [BAD_NICKS_FILE, journal_path(BAD_NICKS_FILE), BAD_WORDS_FILE, journal_path(BAD_WORDS_FILE),
+            EXEMPT_FILE, journal_path(EXEMPT_FILE), PROTECTED_FILE, SETTINGS_FILE]
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def mark_seen(path):
+    """Remember our own writes so the watcher does not reload them."""
+    watch_mtimes[path] = file_mtime(path)
+
+def watch_files_tick(userdata=None):
+    """Timer: re-parse only files changed on disk and publish one new snapshot."""
+    if store_db is not None:
+        poll_store()
+    changed = set()
+    for fp in watched_files():
+        mtime = file_mtime(fp)
+        if watch_mtimes.get(fp) != mtime:
+            watch_mtimes[fp] = mtime
+            changed.add(fp[:-len(".journal")] if fp.endswith(".journal") else fp)
+    if not changed:
+        return True
+    try:
+        parts = {}
+        for fp, key in ((BAD_NICKS_FILE, "nick_rules"), (BAD_WORDS_FILE, "word_rules")):
+            if fp in changed:
+                parts[key] = load_rules_from_file(fp, rule_line_memo.setdefault(fp, {}))
+        if EXEMPT_FILE in changed:
+            parts["exempt"] = load_exempt_list()
+        if PROTECTED_FILE in changed:
+            parts["protected"] = load_protected_channels()
+        if SETTINGS_FILE in changed:
+            load_settings()
+        if parts:
+            publish_ruleset(**parts)
+        log(f"Reloaded {', '.join(sorted(os.path.basename(fp) for fp in changed))}")
+    except Exception as e:
+        log(f"Hot reload error: {e}")
+    return True
+
+# -------------------------
+# Server limits (ISUPPORT / 005)
+# -------------------------
+isupport = {}   # network_lower -> {TOKEN: value}
+
+def on_isupport(word, word_eol, userdata):
+    caps = isupport.setdefault(network_of(), {})
+    for tok in word[3:]:
+        if tok.startswith(":"):
+            break
+        name, _, value = tok.partition("=")
+        caps[name.upper()] = value
+    return hexchat.EAT_NONE
+
+def request_isupport():
+    """
+    005 is only sent at connect, so on (re)load ask each connected server for
+    VERSION, which most ircds answer with their 005 lines again.
+    """
+    asked = set()
+    try:
+        for ch in hexchat.get_list("channels") or []:
+            # type 1 = server tab; flags bit 0 = connected
+            if ch.type != 1 or not ch.flags & 1:
+                continue
+            network = network_of(ch.context)
+            if network and network not in isupport and network not in asked:
+                asked.add(network)
+                ch.context.command("VERSION")
+    except Exception as e:
+        log(f"Error requesting server limits: {e}")
+
+def isupport_int(network, token, default):
+    try:
+        return int(isupport.get(network, {}).get(token) or default)
+    except ValueError:
+        return default
+
+def modes_limit(network):
+    """Mode changes with a parameter allowed per MODE line (MODES=, RFC default 3)."""
+    caps = isupport.get(network, {})
+    if "MODES" in caps and not caps["MODES"]:
+        return MAX_TARGETS_PER_LINE
+    return isupport_int(network, "MODES", 3)
+
+def targmax(network, command, default=1):
+    for item in isupport.get(network, {}).get("TARGMAX", "").split(","):
+        cmd, _, value = item.partition(":")
+        if cmd.upper() == command:
+            try:
+                return int(value) if value else MAX_TARGETS_PER_LINE
+            except ValueError:
+                return default
+    return default
+
+# -------------------------
+# Moderation send queue
+# -------------------------
+SEND_RATE = 2.0              # lines per second per network (token bucket refill)
+SEND_BURST = 5               # bucket size
+QUEUE_TICK_MS = 250
+MAX_TARGETS_PER_LINE = 12    # cap when the server advertises no limit
+MAX_LINE_BYTES = 400         # keep coalesced lines well under the 512 byte limit
+
+action_queue = deque()   # pending action dicts, in enqueue order
+send_buckets = {}        # network -> [tokens, last_refill]
+queue_hook = None
+queue_stats = {"actions": 0, "lines": 0, "wait_total": 0.0, "wait_max": 0.0, "absorbed": 0}
+
+def enqueue_action(kind, ctx, channel, target, reason="", after=None, nick=None, rule=None, urgent=False, network=None):
+    """
+    Queue a moderation action: kind is 'ban', 'unban' or 'kick' (target is a
+    mask or nick), 'mode' (target is a mode string sent on its own line) or
+    'query' (target is a raw line such as a WHO, sent as is and not logged).
+    Urgent actions jump ahead of everything already queued. A kick waits until its 'after' ban was sent + KICK_DELAY_MS.
+    """
+    global queue_hook
+    action = {
+        "kind": kind, "ctx": ctx, "network": network if network is not None else network_of(ctx), "channel": channel,
+        "target": target, "reason": reason, "after": after, "nick": nick, "rule": rule,
+        "queued": time.time(), "sent": None,
+    }
+    if urgent:
+        action_queue.appendleft(action)
+    else:
+        action_queue.append(action)
+    if queue_hook is None:
+        queue_hook = hexchat.hook_timer(QUEUE_TICK_MS, process_queue)
+    return action
+
+def action_ready(action, now):
+    dep = action["after"]
+    if dep is None:
+        return True
+    return dep["sent"] is not None and now - dep["sent"] >= KICK_DELAY_MS / 1000.0
+
+def take_batch(head, now):
+    """Remove head and the queued actions that can share its line."""
+    net, chan = head["network"], head["channel"].lower()
+    if head["kind"] in ("mode", "query"):
+        action_queue.remove(head)
+        return [head]
+    if head["kind"] == "kick":
+        limit = targmax(net, "KICK")
+        same = lambda a: a["kind"] == "kick" and a["reason"] == head["reason"] and action_ready(a, now)
+        size = lambda b: len(",".join(a["target"] for a in b)) + len(head["reason"])
+    else:
+        limit = modes_limit(net)
+        same = lambda a: a["kind"] in ("ban", "unban")
+        size = lambda b: sum(len(a["target"]) + 2 for a in b)
+    batch = [head]
+    for a in action_queue:
+        if len(batch) >= limit:
+            break
+        if a is head or a["network"] != net or a["channel"].lower() != chan or not same(a):
+            continue
+        if size(batch + [a]) > MAX_LINE_BYTES:
+            break
+        batch.append(a)
+    for a in batch:
+        action_queue.remove(a)
+    return batch
+
+def format_batch(batch):
+    head = batch[0]
+    chan = head["channel"]
+    if head["kind"] == "query":
+        return head["target"]
+    if head["kind"] == "mode":
+        return f"MODE {chan} {head['target']}"
+    if head["kind"] == "kick":
+        return f"QUOTE KICK {chan} {','.join(a['target'] for a in batch)} :{head['reason']}"
+    modes, sign = "", ""
+    for a in batch:
+        want = "-" if a["kind"] == "unban" else "+"
+        if want != sign:
+            modes += want
+            sign = want
+        modes += "b"
+    return f"MODE {chan} {modes} {' '.join(a['target'] for a in batch)}"
+
+def send_batch(batch, now):
+    line = format_batch(batch)
+    ctx = batch[0]["ctx"]
+    try:
+        if ctx:
+            ctx.command(line)
+        else:
+            hexchat.command(line)
+    except Exception as e:
+        log(f"Error sending '{line}': {e}")
+    queue_stats["lines"] += 1
+    for a in batch:
+        a["sent"] = now
+        wait = now - a["queued"]
+        queue_stats["actions"] += 1
+        queue_stats["wait_total"] += wait
+        queue_stats["wait_max"] = max(queue_stats["wait_max"], wait)
+        if a["kind"] == "ban":
+            log(f"Set ban {a['target']} in {a['channel']} — reason: {a['reason']} (queued {wait:.2f}s)",
+                channel=a["channel"], nick=a["nick"], rule=a["rule"], action="ban")
+        elif a["kind"] == "query":
+            pass
+        elif a["kind"] == "mode":
+            log(f"Set mode {a['target']} in {a['channel']} (queued {wait:.2f}s)",
+                channel=a["channel"], rule=a["rule"], action="mode")
+        elif a["kind"] == "unban":
+            log(f"Removed ban {a['target']} in {a['channel']} (queued {wait:.2f}s)",
+                channel=a["channel"], rule=a["rule"], action="unban")
+        else:
+            log(f"Sent QUOTE KICK {a['channel']} {a['target']} :{a['reason']} (queued {wait:.2f}s)",
+                channel=a["channel"], nick=a["target"], rule=a["rule"], action="kick")
+
+def process_queue(userdata=None):
+    """Timer: send coalesced lines while each network's token bucket allows."""
+    global queue_hook
+    now = time.time()
+    for net in set(a["network"] for a in action_queue):
+        bucket = send_buckets.setdefault(net, [SEND_BURST, now])
+        bucket[0] = min(SEND_BURST, bucket[0] + (now - bucket[1]) * SEND_RATE)
+        bucket[1] = now
+    for head in list(action_queue):
+        if head not in action_queue:
+            continue   # already sent as part of an earlier batch
+        bucket = send_buckets[head["network"]]
+        if bucket[0] < 1 or not action_ready(head, now):
+            continue
+        send_batch(take_batch(head, now), now)
+        bucket[0] -= 1
+    if action_queue:
+        return True
+    queue_hook = None
+    return False
+
+def drop_queued_actions(network):
+    """
+    Drop a disconnected network's queued actions: their contexts and targets are
+    stale after a reconnect. Expiry unbans go back into the ledger, due at once,
+    so they are sent when we are back in the channel.
+    """
+    kept = [a for a in action_queue if a["network"] != network]
+    for a in action_queue:
+        if a["network"] == network and a["kind"] == "unban" and a["rule"] == "expiry":
+            record_ban(network, a["channel"], a["target"], UNBAN_CHECK_MS / 60000.0, a["reason"])
+    action_queue.clear()
+    action_queue.extend(kept)
+    send_buckets.pop(network, None)
+
+def queue_status():
+    """(depth, oldest pending wait in seconds)"""
+    if not action_queue:
+        return 0, 0.0
+    return len(action_queue), time.time() - action_queue[0]["queued"]
+
+# -------------------------
+# Channel ban lists (+b mirror)
+# -------------------------
+# Each protected channel's ban list is loaded once from the 367/368 replies to
+# "MODE #chan +b" and kept current from the Channel Ban/UnBan events. Bans we
+# queue are added straight away, so a ban that is already set (or covered by a
+# broader mask) never goes out, and the oldest AutoMod bans make room when the
+# list nears the server's MAXLIST/MAXBANS.
+BANLIST_SPARE = 2      # slots left free for other ops when making room
+BANLIST_MIN_AGE = 60   # seconds; younger bans (kick maybe still pending) are never lifted to make room
+BANLIST_MAX_GLOBS = 5000
+ban_lists = {}         # (network, chan_lower) -> {"masks": {mask_lower: [mask, set_at, owned]}, "synced", "loading", "seen", "limit"}
+ban_globs = {}         # mask_lower -> compiled IRC glob
+
+def ban_list(key):
+    bl = ban_lists.get(key)
+    if bl is None:
+        bl = ban_lists[key] = {"masks": {}, "synced": False, "loading": False, "seen": set(), "limit": 0}
+    return bl
+
+def request_ban_list(key, ctx=None):
+    """Ask the server for key's ban list once (sent through the queue, replies are not shown)."""
+    bl = ban_list(key)
+    if bl["synced"] or bl["loading"]:
+        return
+    ctx = ctx or context_for(key)
+    if ctx is None:
+        return
+    bl["loading"] = True
+    bl["seen"] = set()
+    enqueue_action("query", ctx, key[1], f"MODE {key[1]} +b", rule="banlist", network=key[0])
+
+def ban_glob(mask_l):
+    cre = ban_globs.get(mask_l)
+    if cre is None:
+        if len(ban_globs) >= BANLIST_MAX_GLOBS:
+            ban_globs.clear()
+        cre = ban_globs[mask_l] = re.compile(
+            "".join(".*" if ch == "*" else "." if ch == "?" else re.escape(ch) for ch in mask_l), re.DOTALL)
+    return cre
+
+def ban_covered(key, mask, address=None):
+    """The ban on key that already covers mask (or the user's nick!ident@host), else None."""
+    bl = ban_lists.get(key)
+    if not bl or not bl["masks"]:
+        return None
+    mask_l = mask.lower()
+    if mask_l in bl["masks"]:
+        return bl["masks"][mask_l][0]
+    targets = (mask_l, address.lower()) if address else (mask_l,)
+    for m_l, entry in bl["masks"].items():
+        cre = ban_glob(m_l)
+        if any(cre.fullmatch(t) for t in targets):
+            return entry[0]
+    return None
 
-    # try to get ident@host (user host)
-    hostpart = get_user_host(nick)  # ident@host or None
-    mask_to_test = None
-    if hostpart:
-        mask_to_test = f"{nick}!{hostpart}"
+def ban_list_limit(network, bl):
+    """Ban list size: learned from a 'list full' error, else MAXLIST b:/MAXBANS (0 = unknown)."""
+    if bl["limit"]:
+        return bl["limit"]
+    for item in isupport.get(network, {}).get("MAXLIST", "").split(","):
+        modes, _, value = item.partition(":")
+        if "b" in modes and value.isdigit():
+            return int(value)
+    return isupport_int(network, "MAXBANS", 0)
+
+def make_room(key, channel, ctx):
+    """Queue -b for the oldest AutoMod bans when one more would crowd the list; False if it cannot fit."""
+    bl = ban_lists.get(key)
+    if not bl or not bl["synced"]:
+        return True
+    limit = ban_list_limit(key[0], bl)
+    if not limit:
+        return True
+    masks = bl["masks"]
+    excess = len(masks) + 1 - max(limit - BANLIST_SPARE, 1)
+    if excess <= 0:
+        return True
+    cutoff = time.time() - BANLIST_MIN_AGE
+    owned = sorted((entry[1], m_l) for m_l, entry in masks.items() if entry[2] and entry[1] <= cutoff)
+    for set_at, m_l in owned[:excess]:
+        mask = masks.pop(m_l)[0]
+        enqueue_action("unban", ctx, channel, mask, rule="banlist-full", network=key[0])
+        forget_ban(key[0], channel, mask)
+    if owned:
+        log(f"Ban list of {channel} near its limit ({limit}) — lifting {min(excess, len(owned))} oldest AutoMod ban(s)",
+            channel=channel, rule="banlist-full", action="unban")
+    return len(masks) < limit
+
+def note_ban(key, mask, owned=True):
+    entry = ban_list(key)["masks"].setdefault(mask.lower(), [mask, time.time(), owned])
+    entry[2] = entry[2] or owned
+
+def unnote_ban(key, mask):
+    bl = ban_lists.get(key)
+    if bl is not None:
+        bl["masks"].pop(mask.lower(), None)
+
+def on_banlist_entry(word, word_eol, userdata):
+    # 367: [server, 367, me, channel, mask, setter?, set_at?]
+    if len(word) < 5:
+        return hexchat.EAT_NONE
+    key = chan_key(word[3])
+    bl = ban_lists.get(key)
+    if bl is None or not bl["loading"]:
+        return hexchat.EAT_NONE      # a /ban list someone asked for
+    mask = word[4]
+    mask_l = mask.lower()
+    set_at = int(word[6]) if len(word) > 6 and word[6].isdigit() else time.time()
+    owned = (key + (mask_l,)) in ban_ledger
+    entry = bl["masks"].setdefault(mask_l, [mask, set_at, owned])
+    entry[1] = min(entry[1], set_at)
+    bl["seen"].add(mask_l)
+    return hexchat.EAT_HEXCHAT
+
+def on_banlist_end(word, word_eol, userdata):
+    # 368: [server, 368, me, channel, :End of channel ban list]
+    if len(word) < 4:
+        return hexchat.EAT_NONE
+    key = chan_key(word[3])
+    bl = ban_lists.get(key)
+    if bl is None or not bl["loading"]:
+        return hexchat.EAT_NONE
+    # drop what is gone, but keep our own bans that may still be in flight
+    for m_l in [m for m, entry in bl["masks"].items() if m not in bl["seen"] and not entry[2]]:
+        del bl["masks"][m_l]
+    bl["seen"] = set()
+    bl["loading"] = False
+    bl["synced"] = True
+    return hexchat.EAT_HEXCHAT
+
+def on_banlist_full(word, word_eol, userdata):
+    # 478: [server, 478, me, channel, mask, :Channel ban list is full]
+    if len(word) < 5:
+        return hexchat.EAT_NONE
+    key = chan_key(word[3])
+    bl = ban_lists.get(key)
+    if bl is None:
+        return hexchat.EAT_NONE
+    mask = word[4]
+    bl["masks"].pop(mask.lower(), None)
+    bl["limit"] = len(bl["masks"])
+    ctx = context_for(key)
+    if ctx is not None and bl["synced"] and make_room(key, word[3], ctx):
+        note_ban(key, mask)
+        enqueue_action("ban", ctx, word[3], mask, rule="banlist-full", network=key[0])
     else:
-        # If host not found, still allow plain nick wildcard matching
-        mask_to_test = nick
+        log(f"Ban list of {word[3]} is full — could not set {mask}", channel=word[3], rule="banlist-full")
+    return hexchat.EAT_NONE
 
-    for e in exempt_set:
-        if not e:
-            continue
-        # Normalize
-        entry = e.strip()
-        # If entry contains wildcard, use fnmatch on mask_to_test and nick as fallback
-        if "*" in entry:
-            try:
-                if mask_to_test and fnmatch.fnmatch(mask_to_test.lower(), entry.lower()):
-                    return True
-                if fnmatch.fnmatch(nick.lower(), entry.lower()):
-                    return True
-            except Exception:
-                pass
-            continue
-        # If entry contains '@' or '!' treat as mask (match full mask)
-        if "@" in entry or "!" in entry:
-            if mask_to_test and fnmatch.fnmatch(mask_to_test.lower(), entry.lower()):
-                return True
-            # also try match host-only (like *!*@host)
-            if hostpart and fnmatch.fnmatch(hostpart.lower(), entry.lower()):
-                return True
-            continue
-        # plain nick already handled, but double-check (case-insensitive)
-        if nick.lower() == entry.lower():
-            return True
+def banlist_on_ban(word, word_eol, userdata):
+    # Channel Ban: [setter, mask]; Channel UnBan: [setter, mask]
+    if len(word) < 2:
+        return hexchat.EAT_NONE
+    key = chan_key(hexchat.get_info("channel") or "")
+    bl = ban_lists.get(key)
+    if bl is not None:
+        if userdata == "ban":
+            bl["masks"].setdefault(word[1].lower(), [word[1], time.time(), False])
+        else:
+            unnote_ban(key, word[1])
+    return hexchat.EAT_NONE
 
-    return False
+def banlist_on_you_join(word, word_eol, userdata):
+    if len(word) >= 2:
+        key = chan_key(word[1])
+        if is_protected(word[1], network=key[0]):
+            request_ban_list(key, hexchat.get_context())
+    return hexchat.EAT_NONE
 
 # -------------------------
-# Load everything
+# Joiner lookups (WHOX)
 # -------------------------
-def load_all(reset=False):
-    ensure_files_exist(reset)
-    load_settings()
-    global bad_nick_rules, bad_word_rules
-    bad_nick_rules = load_rules_from_file(BAD_NICKS_FILE)
-    bad_word_rules = load_rules_from_file(BAD_WORDS_FILE)
-    load_protected_channels(reset)
-    load_exempt_list()
-    log(f"Loaded {len(bad_nick_rules)} nick rules, {len(bad_word_rules)} word rules, {len(protected_channels)} protected channels.")
+# Joiners are gathered per channel for WHOX_BATCH_MS and resolved with
+# WHOX queries of up to WHOX_MAX_TARGETS nicks each (WHO n1,n2,... %tuhnar,<token>)
+# sent through the send queue; never WHO #chan, which would list every
+# member again during a join flood. Replies are cached per (network, nick),
+# give get_user_host() a host when the userlist has none, and are checked
+# against the host:/real:/account: rules. Servers without WHOX are not asked.
+WHOX_TOKEN = "417"           # marks our replies (at most 3 digits)
+WHOX_BATCH_MS = 1500
+WHOX_MAX_TARGETS = 10        # nicks per WHO line
+WHO_CACHE_SECONDS = 600
+WHO_CACHE_MAX = 5000
+who_cache = OrderedDict()    # (network, nick_lower) -> (ident, host, account or None, realname, fetched_at), LRU order
+who_batches = {}             # (network, chan_lower) -> {nick_lower: nick} waiting to be sent
+who_waiting = {}             # (network, nick_lower) -> {(network, chan_lower): channel} to check on reply
+who_queries = {}             # network -> WHO targets sent and not yet ended by 315
+
+def who_lookup(network, nick_l):
+    """Cached WHOX data for nick, or None when unknown or stale."""
+    info = who_cache.get((network, nick_l))
+    if info is None:
+        return None
+    if time.time() - info[4] > WHO_CACHE_SECONDS:
+        del who_cache[(network, nick_l)]
+        return None
+    who_cache.move_to_end((network, nick_l))
+    return info
+
+def has_identity_rules(rs=None):
+    return (rs or ruleset).nick_engine.get("identity", False)
+
+def lookup_identity(key, channel, nick, live=True):
+    """Check identity rules now if nick's data is cached, else batch a WHOX for it."""
+    nick_l = nick.lower()
+    info = who_lookup(key[0], nick_l)
+    if info is not None:
+        return check_identity(key, channel, nick, info, live)
+    if "WHOX" not in isupport.get(key[0], {}):
+        return False
+    if not has_identity_rules() and host_index.get(key, {}).get(nick_l):
+        return False    # nothing to learn
+    who_waiting.setdefault((key[0], nick_l), {})[key] = channel
+    batch = who_batches.get(key)
+    if batch is None:
+        batch = who_batches[key] = {}
+        hexchat.hook_timer(WHOX_BATCH_MS, flush_who_batch, key)
+    batch[nick_l] = nick
+    return False
+
+def flush_who_batch(key):
+    """Timer: queue WHOX lines for the joiners gathered in key's channel."""
+    nicks = who_batches.pop(key, None)
+    ctx = context_for(key)
+    if not nicks or ctx is None:
+        return False
+    nicks = list(nicks.values())
+    sent = who_queries.setdefault(key[0], set())
+    for i in range(0, len(nicks), WHOX_MAX_TARGETS):
+        target = ",".join(nicks[i:i + WHOX_MAX_TARGETS])
+        sent.add(target.lower())
+        enqueue_action("query", ctx, key[1], f"WHO {target} %tuhnar,{WHOX_TOKEN}", rule="whox", network=key[0])
+    return False
+
+def check_identity(key, channel, nick, info, live=False):
+    """host:/real:/account: rules for one joiner whose WHOX data is known."""
+    rs = ruleset
+    nick_l = nick.lower()
+    if not has_identity_rules(rs) or action_pending(key + (nick_l,)):
+        return False
+    users = host_index.get(key)
+    if users is not None and nick_l not in users:
+        return False    # left before WHOX answered
+    if is_whitelisted(nick) or is_exempt(nick, channel, rs, key):
+        return False
+    ident, host, account, realname, _ = info
+    for field, value in (("host", host), ("real", realname), ("account", account)):
+        if not value:
+            continue
+        pat = match_nick(f"{field}:{value}", rs, channel, field)
+        if pat is not None:
+            return ban_joiner(key, channel, nick, pat, live)
+    return False
 
-load_all(reset=False)
+def on_whox_reply(word, word_eol, userdata):
+    # 354 for %tuhnar: [server, 354, me, token, ident, host, nick, account, :realname]
+    if len(word) < 8 or word[3] != WHOX_TOKEN:
+        return hexchat.EAT_NONE
+    try:
+        network = network_of()
+        ident, host, nick, account = word[4], word[5], word[6], word[7]
+        realname = word_eol[8] if len(word) > 8 else ""
+        if realname.startswith(":"):
+            realname = realname[1:]
+        nick_l = nick.lower()
+        info = (ident, host, None if account == "0" else account, realname, time.time())
+        who_cache[(network, nick_l)] = info
+        who_cache.move_to_end((network, nick_l))
+        while len(who_cache) > WHO_CACHE_MAX:
+            who_cache.popitem(last=False)
+        for key, channel in who_waiting.pop((network, nick_l), {}).items():
+            # only the channels that asked; elsewhere get_user_host() finds it in who_cache
+            users = host_index.get(key)
+            if users is not None and nick_l in users:
+                users[nick_l] = f"{ident}@{host}"
+            check_identity(key, channel, nick, info)
+    except Exception as e:
+        log(f"WHOX reply error: {e}")
+    return hexchat.EAT_HEXCHAT
+
+def on_who_end(word, word_eol, userdata):
+    # 315: [server, 315, me, target, :End of /WHO list.]
+    if len(word) < 4:
+        return hexchat.EAT_NONE
+    network = network_of()
+    target = word[3].lower()
+    if target[:1] in CHANNEL_PREFIXES:
+        resync_host_index((network, target))   # HexChat's post-join WHO filled the hosts in
+    sent = who_queries.get(network)
+    if not sent or target not in sent:
+        return hexchat.EAT_NONE
+    sent.discard(target)
+    # nobody left to answer for: nicks that parted before the reply
+    for nick_l in target.split(","):
+        who_waiting.pop((network, nick_l), None)
+    for wkey in [k for k, waiting in who_waiting.items() if not waiting]:
+        del who_waiting[wkey]
+    return hexchat.EAT_HEXCHAT
+
+def forget_who(network):
+    for d in (who_cache, who_waiting):
+        for k in [k for k in d if k[0] == network]:
+            del d[k]
+    for k in [k for k in who_batches if k[0] == network]:
+        del who_batches[k]
+    who_queries.pop(network, None)
 
 # -------------------------
-# Scheduling helper
+# In-flight actions
 # -------------------------
-def schedule_once(ms, func):
-    def wrapper(userdata=None):
-        try:
-            func()
-        except Exception as e:
-            log(f"Scheduled function error: {e}")
+# A user who trips several detectors (or sends several bad lines) before the
+# kick lands gets one ban/kick: later triggers are absorbed while the first is
+# in flight. Entries clear on the Kick/Part/Quit echo or after PENDING_TTL.
+# Repeat bans of the same mask (clones) are caught by the ban list mirror.
+PENDING_TTL = 30          # seconds
+PENDING_MAX_KEYS = 2000   # expired entries are pruned past this size
+pending_actions = {}      # (network, chan_lower, nick_lower) -> expiry
+
+def action_pending(pkey, now=None):
+    expiry = pending_actions.get(pkey)
+    if expiry is None:
         return False
-    hexchat.hook_timer(ms, wrapper)
+    if expiry <= (now or time.time()):
+        del pending_actions[pkey]
+        return False
+    return True
+
+def mark_pending(pkey, now=None):
+    now = now or time.time()
+    if len(pending_actions) >= PENDING_MAX_KEYS:
+        for k in [k for k, expiry in pending_actions.items() if expiry <= now]:
+            del pending_actions[k]
+    pending_actions[pkey] = now + PENDING_TTL
+
+def pending_on_leave(word, word_eol, userdata):
+    # Kick: [kicker, kicked, channel]; Part: [nick, host, channel]; Quit: [nick, reason, host]
+    try:
+        if userdata == "quit":
+            if word:
+                network, nick_l = network_of(), word[0].lower()
+                for pkey in [k for k in pending_actions if k[0] == network and k[2] == nick_l]:
+                    del pending_actions[pkey]
+        elif len(word) >= 3:
+            nick = word[1] if userdata == "kick" else word[0]
+            pending_actions.pop(chan_key(word[2]) + (nick.lower(),), None)
+    except Exception:
+        pass
+    return hexchat.EAT_NONE
 
 # -------------------------
 # Ban & Kick (QUOTE) - ban uses host when available
 # -------------------------
-def ban_mask_for_nick(nick):
-    host = get_user_host(nick)
+def ban_mask_for_nick(nick, channel=None, key=None):
+    return ban_mask_for_host(nick, get_user_host(nick, channel, key))
+
+def ban_mask_for_host(nick, host):
     if host:
         # host is ident@hostname -> we want *!*@hostname (host ban)
         try:
@@ -425,50 +2266,580 @@ def ban_mask_for_nick(nick):
             pass
     return f"{nick}!*@*"
 
-def apply_ban_and_kick(channel, nick, reason, duration_minutes=None):
-    mask = ban_mask_for_nick(nick)
-    cmd_ban = f"MODE {channel} +b {mask}"
-    cmd_kick_quote = f"QUOTE KICK {channel} {nick} :{reason}"
+def apply_ban_and_kick(channel, nick, reason, duration_minutes=None, rule=None, key=None):
+    if key is None:
+        key = chan_key(channel)
+    pkey = key + (nick.lower(),)
+    if action_pending(pkey):
+        queue_stats["absorbed"] += 1
+        return
+    mark_pending(pkey)
+    host = get_user_host(nick, channel, key)
+    mask = ban_mask_for_host(nick, host)
+    ctx = context_for(key)
+    request_ban_list(key, ctx)
+
+    covered = ban_covered(key, mask, f"{nick}!{host}" if host else None)
+    if covered:
+        # already banned: kick only, and leave the existing ban's expiry alone
+        log(f"Ban {mask} in {channel} already covered by {covered}", channel=channel, nick=nick, rule=rule, action="ban-skip")
+        enqueue_action("kick", ctx, channel, nick, reason, nick=nick, rule=rule, network=key[0])
+        return
+    if not make_room(key, channel, ctx):
+        # full of bans AutoMod does not own (or set too recently to lift)
+        log(f"Ban list of {channel} is full — kicking {nick} without a ban", channel=channel, nick=nick, rule=rule, action="ban-skip")
+        enqueue_action("kick", ctx, channel, nick, reason, nick=nick, rule=rule, network=key[0])
+        return
+    note_ban(key, mask)
+    ban = enqueue_action("ban", ctx, channel, mask, reason, nick=nick, rule=rule, network=key[0])
+    enqueue_action("kick", ctx, channel, nick, reason, after=ban, nick=nick, rule=rule, network=key[0])
+    record_ban(key[0], channel, mask, duration_minutes, reason)
 
+# -------------------------
+# Timed unbans (ban ledger)
+# -------------------------
+BAN_LEDGER_SAVE_MS = 2000
+ban_ledger = {}      # (network, chan_lower, mask_lower) -> {"network", "channel", "mask", "expiry", "reason"}
+ban_heap = []        # (expiry, seq, key) - stale items are skipped when popped
+ban_seq = itertools.count()
+unban_hook = None
+ledger_save_hook = None
+
+def load_ban_ledger():
+    """Read automod_bans.json (or the store's bans table) once at startup (kept across /AUTORELOAD)."""
+    global ban_heap
+    ban_ledger.clear()
+    if store_db is not None:
+        try:
+            store_gens["bans"] = store_generations()["bans"]
+            for network, channel, mask, expiry, reason in store_db.execute(
+                    "SELECT network, channel, mask, expiry, reason FROM bans"):
+                ban_ledger[(network, channel.lower(), mask.lower())] = {
+                    "network": network, "channel": channel, "mask": mask, "expiry": expiry, "reason": reason}
+        except Exception as e:
+            log(f"Error loading bans from store: {e}")
+    elif os.path.exists(BAN_LEDGER_FILE):
+        try:
+            with open(BAN_LEDGER_FILE, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    key = (entry["network"], entry["channel"].lower(), entry["mask"].lower())
+                    ban_ledger[key] = entry
+        except Exception as e:
+            log(f"Error loading ban ledger: {e}")
+    ban_heap = [(e["expiry"], next(ban_seq), key) for key, e in ban_ledger.items()]
+    heapq.heapify(ban_heap)
+    schedule_unban_timer()
+    if ban_ledger:
+        log(f"Loaded {len(ban_ledger)} timed bans.")
+
+def save_ban_ledger(userdata=None):
+    global ledger_save_hook
+    ledger_save_hook = None
+    if store_db is not None:
+        return False   # the store is written on every change
+    tmp = BAN_LEDGER_FILE + ".tmp"
     try:
-        ctx = hexchat.find_context(channel=channel)
-    except Exception:
-        ctx = None
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sorted(ban_ledger.values(), key=lambda e: e["expiry"]), f, indent=1)
+        os.replace(tmp, BAN_LEDGER_FILE)
+    except Exception as e:
+        log(f"Error saving ban ledger: {e}")
+    return False
 
-    try:
-        if ctx:
-            try:
-                ctx.set()
-            except Exception:
-                pass
-            ctx.command(cmd_ban)
+def ledger_changed():
+    """Coalesce ledger writes during ban waves."""
+    global ledger_save_hook
+    if ledger_save_hook is None and store_db is None:
+        ledger_save_hook = hexchat.hook_timer(BAN_LEDGER_SAVE_MS, save_ban_ledger)
+
+def record_ban(network, channel, mask, minutes, reason=""):
+    if not minutes or minutes <= 0:
+        return
+    key = (network, channel.lower(), mask.lower())
+    expiry = time.time() + minutes * 60
+    ban_ledger[key] = {"network": network, "channel": channel, "mask": mask, "expiry": expiry, "reason": reason}
+    heapq.heappush(ban_heap, (expiry, next(ban_seq), key))
+    if store_db is not None:
+        store_write("bans", [(STORE_BAN_UPSERT, key + (channel, mask, expiry, reason))])
+    ledger_changed()
+    if ban_heap[0][2] == key:
+        schedule_unban_timer()
+
+def forget_ban(network, channel, mask):
+    """Drop a timed ban that was lifted early (e.g. to make room on a full ban list)."""
+    key = (network, channel.lower(), mask.lower())
+    if ban_ledger.pop(key, None) is None:
+        return
+    if store_db is not None:
+        store_write("bans", [("DELETE FROM bans WHERE network = ? AND chan = ? AND mask_key = ?", key)])
+    ledger_changed()
+
+def schedule_unban_timer():
+    """Point the single unban timer at the earliest expiry."""
+    global unban_hook
+    if unban_hook is not None:
+        hexchat.unhook(unban_hook)
+        unban_hook = None
+    while ban_heap and ban_ledger.get(ban_heap[0][2], {}).get("expiry") != ban_heap[0][0]:
+        heapq.heappop(ban_heap)   # removed or re-banned since
+    if not ban_heap:
+        return
+    delay_ms = int((ban_heap[0][0] - time.time()) * 1000)
+    unban_hook = hexchat.hook_timer(min(max(delay_ms, 100), UNBAN_CHECK_MS), run_unbans)
+
+def run_unbans(userdata=None):
+    """Timer: queue -b for every expired ban; entries for channels we are not in wait."""
+    global unban_hook
+    unban_hook = None
+    now = time.time()
+    changed = False
+    while ban_heap and ban_heap[0][0] <= now:
+        expiry, _, key = heapq.heappop(ban_heap)
+        entry = ban_ledger.get(key)
+        if entry is None or entry["expiry"] != expiry:
+            continue
+        ctx = context_for((entry["network"], entry["channel"].lower()))
+        if ctx is None:
+            entry["expiry"] = now + UNBAN_CHECK_MS / 1000.0
+            heapq.heappush(ban_heap, (entry["expiry"], next(ban_seq), key))
         else:
-            hexchat.command(cmd_ban)
-        log(f"Set ban {mask} in {channel} — reason: {reason}")
+            del ban_ledger[key]
+            if store_db is not None and not store_claim_unban(key, now):
+                continue   # another instance lifted it, or re-banned for longer
+            unnote_ban(key[:2], entry["mask"])
+            enqueue_action("unban", ctx, entry["channel"], entry["mask"], entry["reason"], rule="expiry", network=entry["network"])
+        changed = True
+    if changed:
+        ledger_changed()
+    schedule_unban_timer()
+    return False
+
+# -------------------------
+# SQLite store (optional, STORE = "sqlite")
+# -------------------------
+# Rules, exempts, protected channels and the ban ledger live in one SQLite
+# database in WAL mode instead of the text files, so HexChat instances that
+# point at the same file share them. Triggers bump a per-table generation on
+# every change; instances poll PRAGMA data_version (which only moves when
+# another connection commits) and re-read just the tables whose generation
+# moved.
+STORE_TABLES = ("rules:nick", "rules:word", "exempts", "channels", "bans")
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (kind TEXT NOT NULL, pattern TEXT NOT NULL, line TEXT NOT NULL,
+    PRIMARY KEY (kind, pattern));
+CREATE TABLE IF NOT EXISTS exempts (entry TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS channels (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS bans (network TEXT NOT NULL, chan TEXT NOT NULL, mask_key TEXT NOT NULL,
+    channel TEXT NOT NULL, mask TEXT NOT NULL, expiry REAL NOT NULL, reason TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (network, chan, mask_key));
+CREATE INDEX IF NOT EXISTS bans_by_mask ON bans (mask_key);
+CREATE INDEX IF NOT EXISTS bans_by_expiry ON bans (expiry);
+CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, gen INTEGER NOT NULL DEFAULT 0);
+"""
+STORE_RULE_UPSERT = ("INSERT INTO rules (kind, pattern, line) VALUES (?, ?, ?) "
+                     "ON CONFLICT (kind, pattern) DO UPDATE SET line = excluded.line")
+STORE_BAN_UPSERT = ("INSERT INTO bans (network, chan, mask_key, channel, mask, expiry, reason) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (network, chan, mask_key) DO UPDATE SET "
+                    "channel = excluded.channel, mask = excluded.mask, expiry = excluded.expiry, reason = excluded.reason")
+store_db = None
+store_gens = {}            # table name -> generation last loaded by this instance
+store_data_version = None
+
+def store_triggers():
+    """SQL for the triggers that bump generations on every insert/update/delete."""
+    sql = []
+    for table, name in (("rules", "'rules:' || {row}.kind"), ("exempts", "'exempts'"),
+                        ("channels", "'channels'"), ("bans", "'bans'")):
+        for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            sql.append(f"CREATE TRIGGER IF NOT EXISTS {table}_{op.lower()} AFTER {op} ON {table} BEGIN "
+                       f"UPDATE generations SET gen = gen + 1 WHERE name = {name.format(row=row)}; END;")
+    return "\n".join(sql)
+
+def open_store(path=None):
+    """Open (creating if needed) the database at path (default automod.db); returns the connection or None."""
+    global store_db, store_data_version
+    close_store()
+    if sqlite3 is None:
+        log("sqlite3 module not available; using the text files.")
+        return None
+    path = path or STORE_FILE
+    try:
+        db = sqlite3.connect(path, timeout=2.0, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(STORE_SCHEMA + store_triggers())
+        db.executemany("INSERT OR IGNORE INTO generations (name) VALUES (?)", [(t,) for t in STORE_TABLES])
     except Exception as e:
-        log(f"Error issuing ban: {e}")
+        log(f"Error opening store {path}: {e}")
+        return None
+    store_db = db
+    store_gens.clear()
+    store_data_version = None
+    log(f"Using SQLite store {path}")
+    return db
+
+def close_store(userdata=None):
+    global store_db
+    if store_db is not None:
+        try:
+            store_db.close()
+        except Exception:
+            pass
+        store_db = None
 
-    def do_kick():
+def use_store():
+    """Open or close the store to match the STORE setting; True when it is in use."""
+    if settings.get("STORE") != "sqlite":
+        close_store()
+        return False
+    return store_db is not None or open_store(settings.get("STORE_PATH") or None) is not None
+
+def store_generations():
+    return dict(store_db.execute("SELECT name, gen FROM generations"))
+
+def store_write(table, statements):
+    """
+    Run (sql, params) pairs on `table` in one transaction; returns the number
+    of rows changed, or None on error. Our own write does not trigger a reload
+    unless another instance changed the table since we last read it.
+    """
+    db = store_db
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        before = db.execute("SELECT gen FROM generations WHERE name = ?", (table,)).fetchone()[0]
+        changed = 0
+        for sql, params in statements:
+            changed += db.execute(sql, params).rowcount
+        after = db.execute("SELECT gen FROM generations WHERE name = ?", (table,)).fetchone()[0]
+        db.execute("COMMIT")
+    except Exception as e:
         try:
-            hexchat.command(cmd_kick_quote)
-            log(f"Sent QUOTE KICK {channel} {nick} :{reason}")
-        except Exception as e:
-            log(f"Failed QUOTE KICK {nick} in {channel}: {e}")
+            db.execute("ROLLBACK")
+        except Exception:
+            pass
+        log(f"Store write error ({table}): {e}")
+        return None
+    if store_gens.get(table) == before:
+        store_gens[table] = after
+    return changed
+
+def store_load_rules(kind):
+    """Rules of one kind in insertion order; unchanged lines reuse their compiled rule."""
+    memo = rule_line_memo.setdefault(f"store:{kind}", {})
+    old = dict(memo)
+    memo.clear()
+    rules = {}
+    for (line,) in store_db.execute("SELECT line FROM rules WHERE kind = ? ORDER BY rowid", (kind,)):
+        compiled = old[line] if line in old else compile_rule_line(line)
+        memo[line] = compiled
+        if compiled:
+            add_loaded_rule(rules, compiled)
+    return rules
+
+def store_read(names):
+    """publish_ruleset() parts for the named tables, read from one snapshot."""
+    parts = {}
+    store_db.execute("BEGIN")
+    try:
+        gens = store_generations()
+        if "rules:nick" in names:
+            parts["nick_rules"] = store_load_rules("nick")
+        if "rules:word" in names:
+            parts["word_rules"] = store_load_rules("word")
+        if "exempts" in names:
+            parts["exempt"] = frozenset(e for (e,) in store_db.execute("SELECT entry FROM exempts"))
+        if "channels" in names:
+            parts["protected"] = frozenset(c for (c,) in store_db.execute("SELECT name FROM channels"))
+    finally:
+        store_db.execute("COMMIT")
+    for name in names:
+        store_gens[name] = gens[name]
+    return parts
+
+def load_all_from_store():
+    global store_data_version
+    store_data_version = store_db.execute("PRAGMA data_version").fetchone()[0]
+    empty = RuleSet(MappingProxyType({}), None, MappingProxyType({}), None, frozenset(), None, frozenset())
+    rs = publish_ruleset(base=empty, **store_read(STORE_TABLES[:4]))
+    load_msg_pools()
+    for fp in watched_files():
+        mark_seen(fp)
+    log(f"Loaded {len(rs.nick_rules)} nick rules, {len(rs.word_rules)} word rules, {len(rs.protected)} protected channels (from SQLite store).")
+    return False
 
-    schedule_once(KICK_DELAY_MS, do_kick)
+def poll_store():
+    """Timer part: pick up tables another instance changed since the last poll."""
+    global store_data_version
+    try:
+        version = store_db.execute("PRAGMA data_version").fetchone()[0]
+        if version == store_data_version:
+            return
+        store_data_version = version
+        gens = store_generations()
+        changed = [name for name in STORE_TABLES if gens.get(name) != store_gens.get(name)]
+        if not changed:
+            return
+        parts = store_read([name for name in changed if name != "bans"])
+        if parts:
+            publish_ruleset(**parts)
+        if "bans" in changed:
+            load_ban_ledger()
+        log(f"Reloaded from store: {', '.join(changed)}")
+    except Exception as e:
+        log(f"Store poll error: {e}")
+
+def save_change(filename, op, text):
+    """Persist one /AMADD, /AMDEL or /AMEXEMPT change: to the store when enabled, else the file's journal."""
+    if store_db is None:
+        append_journal(filename, op, text)
+    elif filename == EXEMPT_FILE:
+        sql = "INSERT OR IGNORE INTO exempts (entry) VALUES (?)" if op == "+" else "DELETE FROM exempts WHERE entry = ?"
+        store_write("exempts", [(sql, (text,))])
+    else:
+        kind = "nick" if filename == BAD_NICKS_FILE else "word"
+        if op == "+":
+            store_write(f"rules:{kind}", [(STORE_RULE_UPSERT, (kind, parse_rule_line(text)[0], text))])
+        else:
+            store_write(f"rules:{kind}", [("DELETE FROM rules WHERE kind = ? AND pattern = ?", (kind, text))])
+
+def store_save_channels(channels):
+    current = set(c for (c,) in store_db.execute("SELECT name FROM channels"))
+    statements = [("DELETE FROM channels WHERE name = ?", (c,)) for c in current - set(channels)]
+    statements += [("INSERT INTO channels (name) VALUES (?)", (c,)) for c in set(channels) - current]
+    if statements:
+        store_write("channels", statements)
+
+def store_claim_unban(key, now):
+    """Delete an expired ban row; False when another instance already lifted or extended it."""
+    changed = store_write("bans", [("DELETE FROM bans WHERE network = ? AND chan = ? AND mask_key = ? AND expiry <= ?",
+                                    key + (now,))])
+    return changed != 0   # a failed write (None) still lifts the ban
+
+def store_import_if_empty():
+    """Fill a new database from the current lists and ban ledger; False if it already had data."""
+    db = store_db
+    if any(db.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in ("rules", "exempts", "channels", "bans")):
+        return False
+    rs = ruleset
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for kind, rules in (("nick", rs.nick_rules), ("word", rs.word_rules)):
+            db.executemany(STORE_RULE_UPSERT, [(kind, pat, format_rule_line(pat, msg, dur, opts))
+                                               for pat, (_, msg, dur, _, opts) in rules.items()])
+        db.executemany("INSERT INTO exempts (entry) VALUES (?)", [(e,) for e in rs.exempt])
+        db.executemany("INSERT INTO channels (name) VALUES (?)", [(c,) for c in rs.protected])
+        db.executemany(STORE_BAN_UPSERT, [key + (e["channel"], e["mask"], e["expiry"], e["reason"])
+                                          for key, e in ban_ledger.items()])
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    log(f"Imported {len(rs.nick_rules) + len(rs.word_rules)} rules, {len(rs.exempt)} exempts, "
+        f"{len(rs.protected)} channels and {len(ban_ledger)} bans into the store.")
+    return True
+
+def export_store_to_files():
+    """Write the current lists and ledger back to the text files and stop using the store."""
+    close_store()
+    for filename in (BAD_NICKS_FILE, BAD_WORDS_FILE, EXEMPT_FILE):
+        compact_journal(filename)
+    save_protected_channels(ruleset.protected)
+    save_ban_ledger()
+
+def banned_anywhere(mask):
+    """(network, channel, expiry) of every timed ban on mask: an indexed query with the store, else a ledger scan."""
+    mask_l = mask.lower()
+    if store_db is not None:
+        try:
+            return store_db.execute("SELECT network, channel, expiry FROM bans WHERE mask_key = ? ORDER BY expiry",
+                                    (mask_l,)).fetchall()
+        except Exception as e:
+            log(f"Store query error: {e}")
+    return sorted(((e["network"], e["channel"], e["expiry"]) for key, e in ban_ledger.items() if key[2] == mask_l),
+                  key=lambda row: row[2])
 
 # -------------------------
 # Flood detection
 # -------------------------
-def record_message_for_flood(channel, nick):
-    key = (channel.lower(), nick.lower())
-    now = time.time()
+def record_message_for_flood(channel, nick, now=None, chan=None):
+    key = (chan or chan_key(channel)) + (nick.lower(),)
+    if now is None:
+        now = time.time()
     window = settings.get("FLOOD_SECONDS", DEFAULTS["FLOOD_SECONDS"])
-    arr = [t for t in flood_records.get(key, []) if now - t <= window]
-    arr.append(now)
-    flood_records[key] = arr
     count = settings.get("FLOOD_COUNT", DEFAULTS["FLOOD_COUNT"])
-    return len(arr) >= count
+    ring = flood_records.get(key)
+    if ring is None or ring.maxlen != max(1, count):
+        ring = deque(maxlen=max(1, count))
+        flood_records[key] = ring
+        if len(flood_records) > FLOOD_MAX_KEYS:
+            flood_records.popitem(last=False)
+    else:
+        flood_records.move_to_end(key)
+    ring.append(now)
+    return len(ring) >= count and now - ring[0] <= window
+
+def sweep_flood_records(userdata=None):
+    """Timer: drop keys idle for longer than the flood window (oldest first)."""
+    now = time.time()
+    window = settings.get("FLOOD_SECONDS", DEFAULTS["FLOOD_SECONDS"])
+    while flood_records:
+        key, ring = next(iter(flood_records.items()))
+        if ring and now - ring[-1] <= window:
+            break
+        del flood_records[key]
+    return True
+
+def flood_tracker_size():
+    """(tracked keys, stored timestamps) for memory checks."""
+    return len(flood_records), sum(len(r) for r in flood_records.values())
+
+# -------------------------
+# Join flood detection & lockdown
+# -------------------------
+LOCKDOWN_BATCH_MS = 2000
+SPLIT_REJOIN_SECONDS = 3600     # joins this soon after a netsplit quit are not counted
+SPLIT_MAX_NICKS = 5000
+# netsplit quit reasons: "irc.a.net irc.b.net", or "*.net *.split" on networks that hide servers
+SPLIT_QUIT_RE = re.compile(r"^[\w*-]+(?:\.[\w*-]+)+ [\w*-]+(?:\.[\w*-]+)+$")
+join_records = {}   # (network, chan_lower) -> deque of last JOINFLOOD_COUNT join timestamps
+lockdowns = {}      # (network, chan_lower) -> {"channel", "ctx", "until", "modes", "args", "pending": [nicks]}
+split_quits = OrderedDict()   # (network, nick_lower) -> time of their netsplit quit, oldest first
+
+def note_split_quit(word, word_eol, userdata):
+    # Quit: [nick, reason, host]
+    if len(word) >= 2 and SPLIT_QUIT_RE.match(word[1]):
+        skey = (network_of(), word[0].lower())
+        split_quits[skey] = time.time()
+        split_quits.move_to_end(skey)
+        while len(split_quits) > SPLIT_MAX_NICKS:
+            split_quits.popitem(last=False)
+    return hexchat.EAT_NONE
+
+def split_rejoin(network, nick):
+    """True (once) when nick is coming back from a netsplit: the heal is not a join flood."""
+    quit_at = split_quits.pop((network, nick.lower()), None)
+    return quit_at is not None and time.time() - quit_at <= SPLIT_REJOIN_SECONDS
+
+def record_join(channel, now=None, chan=None):
+    """O(1) sliding window: True when JOINFLOOD_COUNT joins fall within JOINFLOOD_SECONDS."""
+    count = settings.get("JOINFLOOD_COUNT", DEFAULTS["JOINFLOOD_COUNT"])
+    if count <= 0:
+        return False
+    if now is None:
+        now = time.time()
+    chan = chan or chan_key(channel)
+    ring = join_records.get(chan)
+    if ring is None or ring.maxlen != count:
+        ring = join_records[chan] = deque(maxlen=count)
+    ring.append(now)
+    window = settings.get("JOINFLOOD_SECONDS", DEFAULTS["JOINFLOOD_SECONDS"])
+    return len(ring) >= count and now - ring[0] <= window
+
+def start_lockdown(channel, chan=None):
+    """Set LOCKDOWN_MODES, or push back the lift time if already locked."""
+    chan = chan or chan_key(channel)
+    until = time.time() + settings.get("LOCKDOWN_SECONDS", DEFAULTS["LOCKDOWN_SECONDS"])
+    state = lockdowns.get(chan)
+    if state is not None:
+        state["until"] = until
+        return
+    modes, *args = settings.get("LOCKDOWN_MODES", DEFAULTS["LOCKDOWN_MODES"]).lstrip("+").split() or [""]
+    ctx = context_for(chan)
+    lockdowns[chan] = {"channel": channel, "ctx": ctx, "until": until, "modes": modes, "args": args, "pending": []}
+    if modes:
+        enqueue_action("mode", ctx, channel, " ".join([f"+{modes}"] + args), rule="joinflood", urgent=True, network=chan[0])
+    log(f"Join flood in {channel} — lockdown {' '.join([f'+{modes}'] + args)}", channel=channel, action="lockdown")
+    hexchat.hook_timer(LOCKDOWN_BATCH_MS, lockdown_tick, chan)
+
+def lift_args(network, modes, args):
+    """
+    Arguments to repeat when unsetting modes: only list/always-parameter modes
+    (CHANMODES groups A and B, e.g. +k) need theirs again; +l/+j (group C) do not.
+    """
+    groups = (isupport.get(network, {}).get("CHANMODES") or "b,k,l,").split(",")
+    with_arg = "".join(groups[:3])
+    keep = "".join(groups[:2])
+    lifted, rest = [], list(args)
+    for mode in modes:
+        if mode in with_arg and rest:
+            arg = rest.pop(0)
+            if mode in keep:
+                lifted.append(arg)
+    return lifted
+
+def defer_join(channel, nick, chan=None):
+    state = lockdowns.get(chan or chan_key(channel))
+    if state is not None:
+        state["pending"].append(nick)
+
+def lockdown_tick(chan):
+    """Timer: check joins deferred during lockdown in one batch, lift when due."""
+    state = lockdowns.get(chan)
+    if state is None:
+        return False
+    pending, state["pending"] = state["pending"], []
+    for nick in pending:
+        try:
+            check_join(state["channel"], nick, live=False, key=chan)
+        except Exception as e:
+            log(f"Deferred join check error for {nick}: {e}")
+    if time.time() < state["until"]:
+        return True
+    del lockdowns[chan]
+    join_records.pop(chan, None)
+    if state["modes"]:
+        unset = " ".join([f"-{state['modes']}"] + lift_args(chan[0], state["modes"], state.get("args", [])))
+        enqueue_action("mode", state["ctx"], state["channel"], unset, rule="joinflood", network=chan[0])
+    log(f"Lockdown lifted in {state['channel']}", channel=state["channel"], action="unlock")
+    return False
+
+# -------------------------
+# Cross-nick duplicate message detection
+# -------------------------
+DUP_MAX_PAYLOADS = 256    # distinct recent messages remembered per channel
+DUP_MAX_NICKS = 64        # senders remembered per message
+DUP_MIN_LENGTH = 30       # shorter (normalized) lines are never counted
+dup_records = {}          # (network, chan_lower) -> OrderedDict(hash -> {"first", "nicks", "tripped"}), LRU order
+
+def normalize_for_dup(message):
+    """Case-fold and drop everything but letters and digits, so '  SPAM!! 123' == 'spam123'."""
+    return re.sub(r"[\W_]+", "", message.casefold())
+
+def record_message_for_dup(channel, nick, message, now=None, chan=None):
+    """
+    Count distinct senders of the same normalized line within DUPFLOOD_SECONDS.
+    Returns the nicks to action (all senders when the threshold is crossed,
+    then each later sender of the same line), else an empty list.
+    """
+    threshold = settings.get("DUPFLOOD_NICKS", DEFAULTS["DUPFLOOD_NICKS"])
+    if threshold <= 0:
+        return []
+    norm = normalize_for_dup(message)
+    if len(norm) < DUP_MIN_LENGTH:
+        return []
+    if now is None:
+        now = time.time()
+    window = settings.get("DUPFLOOD_SECONDS", DEFAULTS["DUPFLOOD_SECONDS"])
+    payloads = dup_records.setdefault(chan or chan_key(channel), OrderedDict())
+    key = hash(norm)
+    entry = payloads.get(key)
+    if entry is None or now - entry["first"] > window:
+        entry = {"first": now, "nicks": OrderedDict(), "tripped": False}
+        payloads[key] = entry
+        if len(payloads) > DUP_MAX_PAYLOADS:
+            payloads.popitem(last=False)
+    else:
+        payloads.move_to_end(key)
+    nick_l = nick.lower()
+    if entry["tripped"]:
+        return [] if nick_l in entry["nicks"] else [nick]
+    entry["nicks"][nick_l] = nick
+    if len(entry["nicks"]) > DUP_MAX_NICKS:
+        entry["nicks"].popitem(last=False)
+    if len(entry["nicks"]) >= threshold:
+        entry["tripped"] = True
+        return list(entry["nicks"].values())
+    return []
 
 # -------------------------
 # Event handlers
@@ -476,9 +2847,97 @@ def record_message_for_flood(channel, nick):
 def is_whitelisted(nick):
     return nick in whitelist_nicks
 
-def is_protected(channel):
-    return bool(channel) and channel.lower() in protected_channels
+def is_protected(channel, rs=None, network=None):
+    """Entries are '#chan' (every network) or 'network #chan'."""
+    if not channel:
+        return False
+    protected = (rs or ruleset).protected
+    chan = channel.lower()
+    return chan in protected or (network is not None and f"{network} {chan}" in protected)
+
+def match_nick(nick, rs=None, channel=None, field="nick"):
+    """
+    Return the nick rule pattern that fires for nick in channel, or None.
+    With another field, nick is a 'host:...'/'real:...'/'account:...' subject
+    checked against that field's rules.
+    """
+    rs = rs or ruleset
+    nick_l = nick.lower()
+    engines = scoped_engines(rs.nick_engine, channel)
+    candidates = nick_rule_candidates(engines[0], nick_l, field)
+    if len(engines) > 1:
+        for engine in engines[1:]:
+            candidates.extend(nick_rule_candidates(engine, nick_l, field))
+        candidates.sort()
+    seen = set()
+    for order, pat, core in candidates:
+        if order in seen:
+            continue
+        seen.add(order)
+        try:
+            cre, msg, dur, is_wild, opts = rs.nick_rules[pat]
+            t0 = time.perf_counter_ns() if stats_enabled else 0
+            found = cre.search(nick)
+            if stats_enabled:
+                record_rule("nick", pat, time.perf_counter_ns() - t0)
+            if not found:
+                continue
+
+            if field == "nick" and core and core == nick_l:
+                log(f"Wildcard rule '{pat}' skipped for exact-match nick '{nick}'")
+                continue
+
+            if stats_enabled:
+                record_rule("nick", pat, hit=True)
+            return pat
+
+        except Exception as e:
+            log(f"Error checking join rule '{pat}' against nick '{nick}': {e}")
+            continue
+    return None
+
+def check_join(channel, nick, live=True, key=None):
+    """Exemption + nick rules for one joiner; bans and kicks on a hit."""
+    rs = ruleset
+    if is_whitelisted(nick):
+        return False
+    if key is None:
+        key = chan_key(channel)
+
+    # ✅ Check exemption (host-aware if your is_exempt supports host)
+    if is_exempt(nick, channel, rs, key):
+        return False
 
+    pat = match_nick(nick, rs, channel)
+    if pat is None:
+        # host:/real:/account: rules run once WHOX has answered
+        return lookup_identity(key, channel, nick, live)
+    return ban_joiner(key, channel, nick, pat, live)
+
+def ban_joiner(key, channel, nick, pat, live=True):
+    """Ban and kick a joiner that nick rule pat fired for."""
+    rs = ruleset
+    cre, msg, dur, is_wild, opts = rs.nick_rules[pat]
+
+    if live:
+        # ✅ show join BEFORE kicking
+        hexchat.prnt(f"--> {nick} has joined {channel}")
+
+    reason = msg or get_random_msg(
+        NICK_MSG_FILE,
+        settings.get("BANMSG", "") or "AutoMod: Prohibited nickname"
+    )
+    apply_ban_and_kick(
+        channel,
+        nick,
+        reason,
+        dur if dur is not None else settings.get("UNBAN_MINUTES", DEFAULTS["UNBAN_MINUTES"]),
+        rule=pat,
+        key=key
+    )
+    return True
+
+@instrumented("on_join")
 def on_join(word, word_eol, userdata):
     try:
         if len(word) < 1:
@@ -486,58 +2945,39 @@ def on_join(word, word_eol, userdata):
 
         nick = word[0]
         channel = hexchat.get_info("channel")
+        network = network_of()
 
-        if not is_protected(channel):
-            return hexchat.EAT_NONE
-
-        if is_whitelisted(nick):
+        if not is_protected(channel, network=network):
             return hexchat.EAT_NONE
-
-        # ✅ Check exemption (host-aware if your is_exempt supports host)
-        if is_exempt(nick):
+        key = (network, channel.lower())
+        remember_context(key)
+
+        # --- JOIN FLOOD / LOCKDOWN ---
+        # netsplit heals and exempt/whitelisted users do not count towards a flood
+        counted = not (split_rejoin(network, nick) or is_whitelisted(nick) or is_exempt(nick, channel, key=key))
+        flooding = counted and record_join(channel, chan=key)
+        if flooding or key in lockdowns:
+            if flooding:
+                start_lockdown(channel, key)
+            defer_join(channel, nick, key)
             return hexchat.EAT_NONE
 
-        nick_l = nick.lower()
-
-        for pat, (cre, msg, dur, is_wild) in bad_nick_rules.items():
-            try:
-                if not cre.search(nick):
-                    continue
-
-                if is_wild:
-                    core = re.sub(r"\s+", "", pat)
-                    core = re.sub(r"\*+", "*", core)
-                    core = core.replace("*", "").strip().lower()
-                    if core and core == nick_l:
-                        log(f"Wildcard rule '{pat}' skipped for exact-match nick '{nick}'")
-                        continue
-
-                # ✅ show join BEFORE kicking
-                hexchat.prnt(f"--> {nick} has joined {channel}")
-
-                reason = msg or get_random_msg(
-                    NICK_MSG_FILE,
-                    settings.get("BANMSG", "") or "AutoMod: Prohibited nickname"
-                )
-                apply_ban_and_kick(
-                    channel,
-                    nick,
-                    reason,
-                    dur if dur is not None else settings.get("UNBAN_MINUTES", DEFAULTS["UNBAN_MINUTES"])
-                )
-
-                return hexchat.EAT_NONE      # ✅ allow JOIN to appear
-
-            except Exception as e:
-                log(f"Error checking join rule '{pat}' against nick '{nick}': {e}")
-                continue
+        check_join(channel, nick, key=key)
 
     except Exception as e:
         log(f"on_join exception: {e}")
 
-    return hexchat.EAT_NONE
+    return hexchat.EAT_NONE      # ✅ allow JOIN to appear
+
 
+def clip_message(message):
+    """Cut a message to MAX_MSG_LENGTH chars before any pattern runs on it (0 = no limit)."""
+    limit = settings.get("MAX_MSG_LENGTH", DEFAULTS["MAX_MSG_LENGTH"])
+    if limit and limit > 0 and len(message) > limit:
+        return message[:limit]
+    return message
 
+@instrumented("on_message")
 def on_message(word, word_eol, userdata):
     try:
         if len(word) < 2:
@@ -546,19 +2986,27 @@ def on_message(word, word_eol, userdata):
         nick = word[0]
         message = word_eol[1] if len(word_eol) > 1 else word[1]
         channel = hexchat.get_info("channel")
+        network = network_of()
+        rs = ruleset
 
-        if not is_protected(channel):
+        if not is_protected(channel, rs, network):
             return hexchat.EAT_NONE
 
         if is_whitelisted(nick):
             return hexchat.EAT_NONE
+        key = (network, channel.lower())
+        remember_context(key)
+
+        # already being banned/kicked: nothing more to check
+        if action_pending(key + (nick.lower(),)):
+            return hexchat.EAT_NONE
 
         # ✅ Check exemption
-        if is_exempt(nick):
+        if is_exempt(nick, channel, rs, key):
             return hexchat.EAT_NONE
 
         # --- FLOOD DETECTION ---
-        if record_message_for_flood(channel, nick):
+        if record_message_for_flood(channel, nick, chan=key):
             # ✅ show message BEFORE kick/ban
             hexchat.prnt(f"{nick}: {message}")
 
@@ -571,38 +3019,64 @@ def on_message(word, word_eol, userdata):
                 channel,
                 nick,
                 reason,
-                settings.get("UNBAN_MINUTES", DEFAULTS["UNBAN_MINUTES"])
+                settings.get("UNBAN_MINUTES", DEFAULTS["UNBAN_MINUTES"]),
+                rule="flood",
+                key=key
             )
 
-            flood_records.pop((channel.lower(), nick.lower()), None)
+            flood_records.pop(key + (nick.lower(),), None)
 
             return hexchat.EAT_NONE   # ✅ do NOT hide flood message
 
-        # --- BAD WORD DETECTION ---
-        for pat, (cre, msg, dur, is_wild) in bad_word_rules.items():
-            try:
-                if cre.search(message):
+        # only the first MAX_MSG_LENGTH chars are matched; the full line is still shown
+        text = clip_message(message)
+
+        # --- SAME LINE FROM MANY NICKS ---
+        senders = record_message_for_dup(channel, nick, text, chan=key)
+        if senders:
+            hexchat.prnt(f"{nick}: {message}")
+
+            reason = get_random_msg(
+                FLOOD_MSG_FILE,
+                settings.get("KICKMSG", "") or settings.get("BANMSG", "") or "Flooding the channel"
+            )
+            for sender in senders:
+                if sender.lower() != nick.lower() and is_exempt(sender, channel, rs, key):
+                    continue
+                apply_ban_and_kick(
+                    channel,
+                    sender,
+                    reason,
+                    settings.get("UNBAN_MINUTES", DEFAULTS["UNBAN_MINUTES"]),
+                    rule="dupflood",
+                    key=key
+                )
 
-                    # ✅ show message BEFORE ban
-                    hexchat.prnt(f"{nick}: {message}")
+            return hexchat.EAT_NONE
+
+        # --- BAD WORD DETECTION ---
+        pat = match_rules(scoped_engines(rs.word_engine, channel), text)
+        if pat is not None:
+            cre, msg, dur, is_wild, opts = rs.word_rules[pat]
 
-                    reason = msg or get_random_msg(
-                        WORD_MSG_FILE,
-                        settings.get("BANMSG", "") or "AutoMod: Prohibited language"
-                    )
+            # ✅ show message BEFORE ban
+            hexchat.prnt(f"{nick}: {message}")
 
-                    apply_ban_and_kick(
-                        channel,
-                        nick,
-                        reason,
-                        dur if dur is not None else settings.get("UNBAN_MINUTES", DEFAULTS["UNBAN_MINUTES"])
-                    )
+            reason = msg or get_random_msg(
+                WORD_MSG_FILE,
+                settings.get("BANMSG", "") or "AutoMod: Prohibited language"
+            )
 
-                    return hexchat.EAT_NONE   # ✅ do NOT hide message
+            apply_ban_and_kick(
+                channel,
+                nick,
+                reason,
+                dur if dur is not None else settings.get("UNBAN_MINUTES", DEFAULTS["UNBAN_MINUTES"]),
+                rule=pat,
+                key=key
+            )
 
-            except Exception as e:
-                log(f"Error checking word rule '{pat}' against message: {e}")
-                continue
+            return hexchat.EAT_NONE   # ✅ do NOT hide message
 
     except Exception as e:
         log(f"on_message exception: {e}")
@@ -610,52 +3084,125 @@ def on_message(word, word_eol, userdata):
     return hexchat.EAT_NONE
 
 
-# -------------------------
-# Random message helper
-# -------------------------
-def get_random_msg(filepath, default_msg=""):
-    try:
-        if not os.path.exists(filepath):
-            return default_msg
-        with open(filepath, "r", encoding="utf-8") as f:
-            lines = [ln.strip() for ln in f if ln.strip() and not ln.strip().startswith("#")]
-        if not lines:
-            return default_msg
-        return random.choice(lines)
-    except Exception as e:
-        log(f"Error reading random message from {filepath}: {e}")
-        return default_msg
-
 # -------------------------
 # Commands
 # -------------------------
 def cmd_reload(word, word_eol, userdata):
     load_all(reset=False)
+    host_seeded.clear()
     log("Rules & settings reloaded.")
     return hexchat.EAT_ALL
 
 def cmd_list(word, word_eol, userdata):
+    rs = ruleset
     hexchat.prnt("=== AutoMod Rules & Settings ===")
-    hexchat.prnt(f"Protected channels: {', '.join(sorted(protected_channels)) or '<none>'}")
+    hexchat.prnt(f"Protected channels: {', '.join(sorted(rs.protected)) or '<none>'}")
     hexchat.prnt(f"Settings: UNBAN_MINUTES={settings.get('UNBAN_MINUTES')}, FLOOD={settings.get('FLOOD_COUNT')} msgs/{settings.get('FLOOD_SECONDS')}s")
+    hexchat.prnt(f"Join flood: {settings.get('JOINFLOOD_COUNT')} joins/{settings.get('JOINFLOOD_SECONDS')}s -> +{settings.get('LOCKDOWN_MODES')} for {settings.get('LOCKDOWN_SECONDS')}s; locked: {', '.join(sorted(st['channel'] for st in lockdowns.values())) or '<none>'}")
+    hexchat.prnt(f"Duplicate lines: {settings.get('DUPFLOOD_NICKS')} nicks/{settings.get('DUPFLOOD_SECONDS')}s")
+    hexchat.prnt(f"Store: {'SQLite ' + (settings.get('STORE_PATH') or STORE_FILE) if store_db is not None else 'text files'}")
+    keys, stamps = flood_tracker_size()
+    hexchat.prnt(f"Flood tracker: {keys} keys, {stamps} timestamps (cap {FLOOD_MAX_KEYS} keys)")
     hexchat.prnt("-- Bad Nicks --")
-    for pat, (_, msg, dur, _) in bad_nick_rules.items():
-        hexchat.prnt(f"{pat} :: {msg} :: {dur if dur is not None else settings.get('UNBAN_MINUTES')}m")
+    for pat, (_, msg, dur, _, opts) in rs.nick_rules.items():
+        hexchat.prnt(f"{pat} :: {msg} :: {dur if dur is not None else settings.get('UNBAN_MINUTES')}m" + (f" :: {','.join(opts)}" if opts else ""))
     hexchat.prnt("-- Bad Words --")
-    for pat, (_, msg, dur, _) in bad_word_rules.items():
-        hexchat.prnt(f"{pat} :: {msg} :: {dur if dur is not None else settings.get('UNBAN_MINUTES')}m")
+    for pat, (_, msg, dur, _, opts) in rs.word_rules.items():
+        hexchat.prnt(f"{pat} :: {msg} :: {dur if dur is not None else settings.get('UNBAN_MINUTES')}m" + (f" :: {','.join(opts)}" if opts else ""))
     hexchat.prnt("-- Exempt List --")
-    if exempt_set:
-        for e in sorted(exempt_set):
+    if rs.exempt:
+        for e in sorted(rs.exempt):
             hexchat.prnt(f"{e}")
     else:
         hexchat.prnt("<none>")
     hexchat.prnt("===============================")
     return hexchat.EAT_ALL
 
+def cmd_queue(word, word_eol, userdata):
+    depth, oldest = queue_status()
+    done = queue_stats["actions"]
+    avg = queue_stats["wait_total"] / done if done else 0.0
+    hexchat.prnt(f"Send queue: {depth} pending (oldest waiting {oldest:.2f}s)")
+    hexchat.prnt(f"Sent {done} actions in {queue_stats['lines']} lines — wait avg {avg:.2f}s, max {queue_stats['wait_max']:.2f}s")
+    hexchat.prnt(f"In flight: {len(pending_actions)} users — {queue_stats['absorbed']} repeat triggers absorbed")
+    return hexchat.EAT_ALL
+
+def cmd_bans(word, word_eol, userdata):
+    now = time.time()
+    if len(word) >= 2:
+        # /AMBANS <nick|mask>: where is this host banned?
+        target = word[1]
+        mask = target if "!" in target or "@" in target else ban_mask_for_nick(target, hexchat.get_info("channel"))
+        rows = banned_anywhere(mask)
+        hexchat.prnt(f"=== Timed bans on {mask} ({len(rows)}) ===")
+        for network, channel, expiry in rows:
+            hexchat.prnt(f"{network} {channel} — {max(0, int((expiry - now) / 60))}m left")
+        return hexchat.EAT_ALL
+    hexchat.prnt(f"=== AutoMod timed bans ({len(ban_ledger)}) ===")
+    for e in sorted(ban_ledger.values(), key=lambda e: e["expiry"])[:50]:
+        left = max(0, int((e["expiry"] - now) / 60))
+        hexchat.prnt(f"{e['network']} {e['channel']} {e['mask']} — {left}m left — {e['reason']}")
+    return hexchat.EAT_ALL
+
+STATS_SORT_KEYS = {
+    "total": lambda st: st[1],
+    "avg": lambda st: st[1] / st[0] if st[0] else 0,
+    "calls": lambda st: st[0],
+    "max": lambda st: st[2],
+}
+
+def bucket_label(i):
+    return f"<={STATS_BUCKETS_US[i]}µs" if i < len(STATS_BUCKETS_US) else f">{STATS_BUCKETS_US[-1]}µs"
+
+def fmt_ns(ns):
+    if ns >= 1000000:
+        return f"{ns / 1000000:.1f}ms"
+    return f"{ns / 1000:.1f}µs"
+
+def cmd_stats(word, word_eol, userdata):
+    # Usage: /AMSTATS [ON|OFF|RESET] | [total|avg|calls|max] | RULES [total|avg|calls|hits] [count]
+    global stats_enabled
+    sub = word[1].upper() if len(word) > 1 else ""
+    if sub in ("ON", "OFF"):
+        stats_enabled = sub == "ON"
+        hexchat.prnt(f"AutoMod stats {'enabled' if stats_enabled else 'disabled'}.")
+        return hexchat.EAT_ALL
+    if sub == "RESET":
+        reset_stats()
+        hexchat.prnt("AutoMod stats cleared.")
+        return hexchat.EAT_ALL
+
+    state = "on" if stats_enabled else "off (/AMSTATS ON to start)"
+    hexchat.prnt(f"=== AutoMod stats — sampling {state}, since {time.strftime('%H:%M:%S', time.localtime(stats_since))} ===")
+    if sub == "RULES":
+        key = word[2].lower() if len(word) > 2 and word[2].lower() in ("total", "avg", "calls", "hits") else "total"
+        try:
+            count = int(word[-1]) if len(word) > 2 else 20
+        except ValueError:
+            count = 20
+        sort_key = (lambda st: st[2]) if key == "hits" else STATS_SORT_KEYS[key]
+        rows = sorted(rule_stats.items(), key=lambda kv: sort_key(kv[1]), reverse=True)
+        hexchat.prnt(f"Rules by {key} ({len(rule_stats)} tracked):")
+        for (kind, pat), (evals, total, hits) in rows[:count]:
+            avg = total / evals if evals else 0
+            hexchat.prnt(f"  {kind:4} {pat[:40]:40} evals={evals} total={fmt_ns(total)} avg={fmt_ns(avg)} hits={hits}")
+        return hexchat.EAT_ALL
+
+    key = sub.lower() if sub.lower() in STATS_SORT_KEYS else "total"
+    hexchat.prnt(f"Hooks by {key}:")
+    for name, (calls, total, mx, buckets) in sorted(hook_stats.items(), key=lambda kv: STATS_SORT_KEYS[key](kv[1]), reverse=True):
+        p50 = histogram_percentile(buckets, 0.50)
+        p99 = histogram_percentile(buckets, 0.99)
+        hexchat.prnt(f"  {name:14} calls={calls} total={fmt_ns(total)} avg={fmt_ns(total / calls if calls else 0)} max={fmt_ns(mx)} p50{bucket_label(p50)} p99{bucket_label(p99)}")
+        hexchat.prnt("    " + " ".join(f"{bucket_label(i)}:{n}" for i, n in enumerate(buckets) if n))
+    if not hook_stats:
+        hexchat.prnt("  <no samples>")
+    hexchat.prnt("Top rules by cost: /AMSTATS RULES [total|avg|calls|hits] [count]")
+    return hexchat.EAT_ALL
+
 def cmd_add(word, word_eol, userdata):
     if len(word) < 3:
-        hexchat.prnt("Usage: /AMADD <nick|word> pattern::message::minutes?")
+        hexchat.prnt("Usage: /AMADD <nick|word> pattern::message::minutes?::options?")
         return hexchat.EAT_ALL
     kind = word[1].lower()
     entry = " ".join(word[2:]).strip()
@@ -663,19 +3210,31 @@ def cmd_add(word, word_eol, userdata):
     if not parsed:
         hexchat.prnt("Invalid rule format. Use: pattern :: message :: minutes(optional)")
         return hexchat.EAT_ALL
-    pat, msg, dur = parsed
+    pat, msg, dur, opts = parsed
     is_new_wild = ("*" in pat)
     cre, is_wild = pattern_to_regex(pat, is_new_rule=is_new_wild)
     if cre is None:
         hexchat.prnt("Invalid regex/pattern.")
         return hexchat.EAT_ALL
+    risk = rule_risk(pat, cre, is_wild)
+    if risk:
+        hexchat.prnt(f"Pattern rejected, it could freeze HexChat on a crafted message: {risk}")
+        return hexchat.EAT_ALL
+    current = ruleset.nick_rules if kind == "nick" else ruleset.word_rules if kind == "word" else {}
+    conflict = rule_conflict(current, pat, (cre, msg, dur, is_wild, opts))
+    if conflict:
+        hexchat.prnt(conflict)
     if kind == "nick":
-        bad_nick_rules[pat] = (cre, msg, dur, is_wild)
-        save_rules_to_file(bad_nick_rules, BAD_NICKS_FILE)
+        rules = dict(ruleset.nick_rules)
+        rules[pat] = (cre, msg, dur, is_wild, opts)
+        publish_ruleset(nick_rules=rules)
+        save_change(BAD_NICKS_FILE, "+", format_rule_line(pat, msg, dur, opts))
         hexchat.prnt(f"Added nick rule: {pat}")
     elif kind == "word":
-        bad_word_rules[pat] = (cre, msg, dur, is_wild)
-        save_rules_to_file(bad_word_rules, BAD_WORDS_FILE)
+        rules = dict(ruleset.word_rules)
+        rules[pat] = (cre, msg, dur, is_wild, opts)
+        publish_ruleset(word_rules=rules)
+        save_change(BAD_WORDS_FILE, "+", format_rule_line(pat, msg, dur, opts))
         hexchat.prnt(f"Added word rule: {pat}")
     else:
         hexchat.prnt("Type must be 'nick' or 'word'.")
@@ -687,13 +3246,15 @@ def cmd_del(word, word_eol, userdata):
         return hexchat.EAT_ALL
     kind = word[1].lower()
     pat = " ".join(word[2:]).strip()
-    rules = bad_nick_rules if kind == "nick" else bad_word_rules if kind == "word" else None
+    rules = ruleset.nick_rules if kind == "nick" else ruleset.word_rules if kind == "word" else None
     if rules is None:
         hexchat.prnt("Type must be 'nick' or 'word'.")
         return hexchat.EAT_ALL
     if pat in rules:
+        rules = dict(rules)
         rules.pop(pat, None)
-        save_rules_to_file(rules, BAD_NICKS_FILE if kind == "nick" else BAD_WORDS_FILE)
+        publish_ruleset(**{f"{kind}_rules": rules})
+        save_change(BAD_NICKS_FILE if kind == "nick" else BAD_WORDS_FILE, "-", pat)
         hexchat.prnt(f"Removed {kind} rule: {pat}")
     else:
         hexchat.prnt("Pattern not found.")
@@ -704,7 +3265,7 @@ def cmd_del(word, word_eol, userdata):
 # -------------------------
 def cmd_chan(word, word_eol, userdata):
     if len(word) < 2:
-        hexchat.prnt("Usage: /AMCHAN <#channel>")
+        hexchat.prnt("Usage: /AMCHAN <#channel> [network]")
         return hexchat.EAT_ALL
 
     channel = word[1].strip().lower()
@@ -713,17 +3274,22 @@ def cmd_chan(word, word_eol, userdata):
     if not channel.startswith("#"):
         hexchat.prnt("Channel must start with #")
         return hexchat.EAT_ALL
+    if len(word) >= 3:
+        # only on that network
+        channel = f"{word[2].lower()} {channel}"
 
     # Toggle protection
-    if channel in protected_channels:
-        protected_channels.remove(channel)
+    channels = set(ruleset.protected)
+    if channel in channels:
+        channels.remove(channel)
         hexchat.prnt(f"Removed protection for {channel}")
     else:
-        protected_channels.add(channel)
+        channels.add(channel)
         hexchat.prnt(f"Added protection for {channel}")
+    publish_ruleset(protected=channels)
 
     # Save protected channels immediately after modification
-    save_protected_channels()
+    save_protected_channels(channels)
 
     return hexchat.EAT_ALL
 # -------------------------
@@ -732,34 +3298,23 @@ def cmd_chan(word, word_eol, userdata):
 # Define RESET_CONFIGS before using it
 RESET_CONFIGS = False  # Change to True if you want to reset configurations
 
-# Initialize function to load everything
+# Initialize function to load everything (runs once per plugin load)
 def initialize():
-    load_protected_channels()  # Ensure protected channels are loaded at startup
-    # Other initialization code (e.g., load settings, rules, etc.)
-    load_all(reset=RESET_CONFIGS)
+    started = time.perf_counter()
+    warm = load_all(reset=RESET_CONFIGS)
+    log(f"Startup loaded in {(time.perf_counter() - started) * 1000:.0f} ms ({'warm' if warm else 'cold'} rule cache)")
 
-# Call the initialization function to load everything
-initialize()
-
-
-# -------------------------
-# Call the initialization function to load everything
-# -------------------------
 initialize()
 
-# -------------------------
-# Register the AMCHAN command
-# -------------------------
-hexchat.hook_command("AMCHAN", cmd_chan, help="/AMCHAN #channel — Toggle protection for a channel")
-
 def cmd_unchan(word, word_eol, userdata):
     if len(word) < 2:
-        hexchat.prnt("[AutoMod] Usage: /AMUNCHAN #channel")
+        hexchat.prnt("[AutoMod] Usage: /AMUNCHAN #channel [network]")
         return hexchat.EAT_ALL
-    channel = word[1].lower()
-    if channel in protected_channels:
-        protected_channels.remove(channel)
-        save_protected_channels()
+    channel = word[1].lower() if len(word) < 3 else f"{word[2].lower()} {word[1].lower()}"
+    if channel in ruleset.protected:
+        channels = ruleset.protected - {channel}
+        publish_ruleset(protected=channels)
+        save_protected_channels(channels)
         hexchat.prnt(f"[AutoMod] Removed protection: {channel}")
     else:
         hexchat.prnt(f"[AutoMod] Channel not in protection list: {channel}")
@@ -767,7 +3322,7 @@ def cmd_unchan(word, word_eol, userdata):
 
 def cmd_set(word, word_eol, userdata):
     if len(word) < 2:
-        hexchat.prnt("Usage: /AMSET <UNBAN_MINUTES|KICKMSG|BANMSG|FLOOD|DEFAULTBAN> args...")
+        hexchat.prnt("Usage: /AMSET <UNBAN_MINUTES|KICKMSG|BANMSG|FLOOD|JOINFLOOD|LOCKDOWN|DUPFLOOD|MAXLEN|STORE|DEFAULTBAN> args...")
         return hexchat.EAT_ALL
     opt = word[1].upper()
     if opt == "UNBAN_MINUTES" and len(word) >= 3:
@@ -793,10 +3348,75 @@ def cmd_set(word, word_eol, userdata):
             cnt = int(word[2]); secs = int(word[3])
             settings["FLOOD_COUNT"] = cnt
             settings["FLOOD_SECONDS"] = secs
+            flood_records.clear()
             save_settings()
             hexchat.prnt(f"FLOOD set to {cnt} msgs/{secs}s")
         except:
             hexchat.prnt("Invalid numbers.")
+    elif opt == "JOINFLOOD" and len(word) >= 4:
+        try:
+            cnt = int(word[2]); secs = int(word[3])
+            settings["JOINFLOOD_COUNT"] = cnt
+            settings["JOINFLOOD_SECONDS"] = secs
+            join_records.clear()
+            save_settings()
+            hexchat.prnt(f"JOINFLOOD set to {cnt} joins/{secs}s" + (" (disabled)" if cnt <= 0 else ""))
+        except:
+            hexchat.prnt("Invalid numbers.")
+    elif opt == "DUPFLOOD" and len(word) >= 4:
+        try:
+            cnt = int(word[2]); secs = int(word[3])
+            settings["DUPFLOOD_NICKS"] = cnt
+            settings["DUPFLOOD_SECONDS"] = secs
+            dup_records.clear()
+            save_settings()
+            hexchat.prnt(f"DUPFLOOD set to {cnt} nicks/{secs}s" + (" (disabled)" if cnt <= 0 else ""))
+        except:
+            hexchat.prnt("Invalid numbers.")
+    elif opt == "MAXLEN" and len(word) >= 3:
+        try:
+            val = int(word[2])
+            settings["MAX_MSG_LENGTH"] = val
+            save_settings()
+            hexchat.prnt(f"MAX_MSG_LENGTH set to {val}" + (" (no limit)" if val <= 0 else ""))
+        except:
+            hexchat.prnt("Invalid number.")
+    elif opt == "STORE" and len(word) >= 3 and word[2].lower() in ("sqlite", "files"):
+        if word[2].lower() == "sqlite":
+            path = word_eol[3].strip() if len(word) >= 4 else ""
+            if open_store(path or None) is None:
+                hexchat.prnt("Could not open the SQLite store (see automod_log.txt).")
+                return hexchat.EAT_ALL
+            try:
+                imported = store_import_if_empty()
+            except Exception as e:
+                close_store()
+                hexchat.prnt(f"Could not import into the SQLite store: {e}")
+                return hexchat.EAT_ALL
+            settings["STORE"] = "sqlite"
+            settings["STORE_PATH"] = path
+            save_settings()
+            load_all()
+            load_ban_ledger()
+            hexchat.prnt(f"Using SQLite store {path or STORE_FILE}" + (" (imported the current lists)" if imported else ""))
+        else:
+            if store_db is not None:
+                export_store_to_files()
+            settings["STORE"] = "files"
+            save_settings()
+            load_all()
+            load_ban_ledger()
+            hexchat.prnt("Using the text files.")
+    elif opt == "LOCKDOWN" and len(word) >= 4:
+        try:
+            # /AMSET LOCKDOWN <modes> [mode args...] <seconds>, e.g. /AMSET LOCKDOWN j 3:5 120
+            modes = " ".join([word[2].lstrip("+")] + word[3:-1]); secs = int(word[-1])
+            settings["LOCKDOWN_MODES"] = modes
+            settings["LOCKDOWN_SECONDS"] = secs
+            save_settings()
+            hexchat.prnt(f"LOCKDOWN set to +{modes} for {secs}s")
+        except:
+            hexchat.prnt("Invalid numbers.")
     elif opt == "DEFAULTBAN" and len(word) >= 3:
         try:
             val = int(word[2])
@@ -824,10 +3444,16 @@ def cmd_help(word, word_eol, userdata):
         "/AMMENU         Show text menu",
         "/AMHELP         Show this help",
         "/AMLIST         List rules & channels",
-        "/AMADD          Add rule: /AMADD <nick|word> pattern::message::minutes?",
+        "/AMQUEUE        Show pending bans/kicks and send delays",
+        "/AMBANS [nick|mask]  Show timed bans, or where one host is banned",
+        "/AMSTATS [ON|OFF|RESET]  Hook timings; /AMSTATS RULES for per-rule cost/hits",
+        "/AMADD          Add rule: /AMADD <nick|word> pattern::message::minutes?::options?",
+        "                options: norm (word rules: also match after stripping colors/leet/look-alikes)",
+        "                         #chan,#glob-* (only apply the rule in these channels)",
+        "                nick patterns host:*.isp.net, real:*text*, account:name match joiners' WHOX data",
         "/AMDEL          Delete rule: /AMDEL <nick|word> pattern",
-        "/AMCHAN         Toggle protection for a channel",
-        "/AMUNCHAN       Toggle remove protection for a channel",
+        "/AMCHAN         Toggle protection for a channel: /AMCHAN #chan [network]",
+        "/AMUNCHAN       Toggle remove protection for a channel: /AMUNCHAN #chan [network]",
         "/AMEXEMPT ADD <entry>   Add exempt nick or mask",
         "/AMEXEMPT DEL <entry>   Remove exempt entry",
         "/AMEXEMPT LIST          Show exempt list",
@@ -835,6 +3461,11 @@ def cmd_help(word, word_eol, userdata):
         "/AMSET KICKMSG <text>      Set default kick message",
         "/AMSET BANMSG <text>       Set default ban message",
         "/AMSET FLOOD <count> <s>   Configure flood detection",
+        "/AMSET JOINFLOOD <count> <s>  Joins per channel that trigger lockdown (0 = off)",
+        "/AMSET LOCKDOWN <modes> [args] <s>  Lockdown modes (e.g. im, j 3:5) and duration",
+        "/AMSET DUPFLOOD <nicks> <s>   Same line from this many nicks bans them all (0 = off)",
+        "/AMSET MAXLEN <n>          Only match the first n chars of a message (0 = no limit)",
+        "/AMSET STORE <sqlite [path]|files>  Keep lists and bans in a shared SQLite database",
         "/AUTORELOAD     Reload rules and settings",
     ]
     for l in help_lines:
@@ -855,25 +3486,25 @@ def cmd_am_exempt(word, word_eol, userdata):
         if not target:
             hexchat.prnt("Usage: /AMEXEMPT ADD <nick/host/mask>")
             return hexchat.EAT_ALL
-        exempt_set.add(target)
-        save_exempt_list()
+        publish_ruleset(exempt=ruleset.exempt | {target})
+        save_change(EXEMPT_FILE, "+", target)
         hexchat.prnt(f"✅ Added to exempt list: {target}")
         return hexchat.EAT_ALL
     if action == "DEL":
         if not target:
             hexchat.prnt("Usage: /AMEXEMPT DEL <nick/host/mask>")
             return hexchat.EAT_ALL
-        if target in exempt_set:
-            exempt_set.remove(target)
-            save_exempt_list()
+        if target in ruleset.exempt:
+            publish_ruleset(exempt=ruleset.exempt - {target})
+            save_change(EXEMPT_FILE, "-", target)
             hexchat.prnt(f"❌ Removed from exempt list: {target}")
         else:
             hexchat.prnt("Not found in exempt list.")
         return hexchat.EAT_ALL
     if action == "LIST":
         hexchat.prnt("📌 Exempt List:")
-        if exempt_set:
-            for e in sorted(exempt_set):
+        if ruleset.exempt:
+            for e in sorted(ruleset.exempt):
                 hexchat.prnt(f"  - {e}")
         else:
             hexchat.prnt("  <none>")
@@ -905,14 +3536,55 @@ def show_text_menu(word=None, word_eol=None, userdata=None):
 # -------------------------
 # Hooks & init
 # -------------------------
+# host index hooks run first so the handlers below see current hosts
+hexchat.hook_print("Join", index_on_join, priority=hexchat.PRI_HIGH)
+for evt in ("Part", "Part with Reason"):
+    hexchat.hook_print(evt, index_on_part, priority=hexchat.PRI_HIGH)
+hexchat.hook_print("Kick", index_on_kick, priority=hexchat.PRI_HIGH)
+hexchat.hook_print("Quit", index_on_quit, priority=hexchat.PRI_HIGH)
+hexchat.hook_print("Change Nick", index_on_nick_change, priority=hexchat.PRI_HIGH)
+hexchat.hook_print("You Join", index_on_you_join)
+hexchat.hook_server("366", index_on_names_end)
+hexchat.hook_print("You Part", index_on_you_leave, "part")
+hexchat.hook_print("You Part with Reason", index_on_you_leave, "part")
+hexchat.hook_print("You Kicked", index_on_you_leave, "kicked")
+
+hexchat.hook_print("Kick", pending_on_leave, "kick")
+for evt in ("Part", "Part with Reason"):
+    hexchat.hook_print(evt, pending_on_leave, "part")
+hexchat.hook_print("Quit", pending_on_leave, "quit")
+hexchat.hook_print("Quit", note_split_quit)
+
 hexchat.hook_print("Join", on_join)
 hexchat.hook_print("Channel Message", on_message)
 
+hexchat.hook_timer(FLOOD_SWEEP_MS, sweep_flood_records)
+hexchat.hook_print("Close Context", on_close_context)
+hexchat.hook_print("Disconnected", on_disconnected)
+hexchat.hook_server("005", on_isupport)
+hexchat.hook_server("367", on_banlist_entry)
+hexchat.hook_server("368", on_banlist_end)
+hexchat.hook_server("478", on_banlist_full)
+hexchat.hook_server("354", on_whox_reply)
+hexchat.hook_server("315", on_who_end)
+hexchat.hook_print("Channel Ban", banlist_on_ban, "ban")
+hexchat.hook_print("Channel UnBan", banlist_on_ban, "unban")
+hexchat.hook_print("You Join", banlist_on_you_join, priority=hexchat.PRI_LOW)
+hexchat.hook_unload(flush_log)
+hexchat.hook_unload(save_ban_ledger)
+hexchat.hook_unload(close_store)
+hexchat.hook_timer(WATCH_MS, watch_files_tick)
+load_ban_ledger()
+request_isupport()
+
 hexchat.hook_command("AUTORELOAD", cmd_reload)
 hexchat.hook_command("AMLIST", cmd_list)
+hexchat.hook_command("AMQUEUE", cmd_queue)
+hexchat.hook_command("AMBANS", cmd_bans)
+hexchat.hook_command("AMSTATS", cmd_stats)
 hexchat.hook_command("AMADD", cmd_add)
 hexchat.hook_command("AMDEL", cmd_del)
-hexchat.hook_command("AMCHAN", cmd_chan)
+hexchat.hook_command("AMCHAN", cmd_chan, help="/AMCHAN #channel — Toggle protection for a channel")
 hexchat.hook_command("AMUNCHAN", cmd_unchan)
 hexchat.hook_command("AMSET", cmd_set)
 hexchat.hook_command("AMGUI", cmd_gui)
@@ -925,7 +3597,7 @@ if os.path.exists(README_PATH):
     log(f"Documentation: {README_PATH}")
 else:
     log("README not found in addons folder.")
-log(f"{__module_name__} v{__module_version__} loaded. Protected: {', '.join(sorted(protected_channels)) or '<none>'}")
+log(f"{__module_name__} v{__module_version__} loaded. Protected: {', '.join(sorted(ruleset.protected)) or '<none>'}")
 
 
 # End of script
@@ -0,0 +1,60 @@
+# ============================================================
+#  Load AutoMod outside HexChat (benchmarks, log replay)
+#  - Puts tools/hexchat.py on sys.path as the `hexchat` module
+#  - Imports Auto_Mod_final_v1.0_wildban.py from the repo root
+# ============================================================
+
+import importlib.util
+import os
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+PLUGIN_PATH = os.path.join(REPO_DIR, "Auto_Mod_final_v1.0_wildban.py")
+
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+import hexchat  # noqa: E402  (the stand-in above)
+
+def load_plugin(quiet=True, configdir=None):
+    """Import the plugin once against the stand-in hexchat module and return it."""
+    hexchat.record = not quiet
+    if configdir:
+        hexchat.info["configdir"] = configdir
+    spec = importlib.util.spec_from_file_location("automod", PLUGIN_PATH)
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    hexchat.reset()
+    return plugin
+
+def compile_rules(plugin, lines):
+    """Rule lines ('pattern :: message :: minutes') -> rules dict as the plugin stores them."""
+    rules = {}
+    for line in lines:
+        compiled = plugin.compile_rule_line(line)
+        if compiled:
+            rules[compiled[0]] = compiled[1]
+    return rules
+
+def quiet_settings(plugin):
+    """Turn off detectors a replay/benchmark should not trip by accident."""
+    plugin.settings.update({
+        "FLOOD_COUNT": 10 ** 9,
+        "JOINFLOOD_COUNT": 0,
+        "DUPFLOOD_NICKS": 0,
+    })
+
+def reset_runtime(plugin):
+    """Drop per-event state the plugin accumulated (queues, trackers, indexes, logs)."""
+    plugin.action_queue.clear()
+    plugin.flood_records.clear()
+    plugin.dup_records.clear()
+    plugin.join_records.clear()
+    plugin.lockdowns.clear()
+    plugin.host_index.clear()
+    plugin.host_seeded.clear()
+    plugin.ban_ledger.clear()
+    del plugin.ban_heap[:]
+    del plugin.log_buffer[:]
+    hexchat.reset()
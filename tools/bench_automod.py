@@ -0,0 +1,244 @@
+"""
+AutoMod offline benchmarks: replays generated traffic through on_message,
+on_join and is_exempt with the stand-in hexchat module (tools/hexchat.py).
+
+    python tools/bench_automod.py               # run and print p50/p99 per case
+    python tools/bench_automod.py --save        # ... and store tools/bench_baseline.json
+    python tools/bench_automod.py --compare     # ... and exit 1 on p99 regressions vs the baseline
+    python tools/bench_automod.py --quick       # fewer events per case
+
+Latencies are wall-clock per handler call, so baselines are only comparable
+on the same machine. Allocations are measured on a separate tracemalloc pass.
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import automod_offline  # noqa: E402
+import hexchat  # noqa: E402
+
+BASELINE_FILE = os.path.join(automod_offline.TOOLS_DIR, "bench_baseline.json")
+CHANNEL = "#bench"
+HIT_RATE = 0.02               # share of events that should match a rule
+REGRESSION_FACTOR = 2.0       # p99 may grow this much ...
+REGRESSION_SLACK_US = 25.0    # ... plus this many microseconds before --compare fails
+
+# -------------------------
+# Traffic generation
+# -------------------------
+def rand_word(rng, lo=4, hi=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(lo, hi)))
+
+def gen_rule_lines(rng, n):
+    """Mix of literal (80%), *word* (15%), inner wildcard (4%) and regex (1%) rules."""
+    lines, words = [], []
+    for i in range(n):
+        w = rand_word(rng, 5, 10)
+        words.append(w)
+        roll = rng.random()
+        if roll < 0.80:
+            pat = w
+        elif roll < 0.95:
+            pat = f"*{w}*"
+        elif roll < 0.99:
+            pat = f"*{w[:3]}*{w[3:]}*"
+        else:
+            pat = f"{w[:3]}[0-9]+{w[3:]}"
+        lines.append(f"{pat} :: bench rule {i} :: 5")
+    return lines, words
+
+def gen_users(rng, n):
+    return [hexchat.User(f"user{i}{rand_word(rng, 2, 4)}", f"id{i}@host{i}.{rand_word(rng, 3, 6)}.net") for i in range(n)]
+
+def gen_exempt(rng, n, users):
+    """Plain nicks, *!*@host masks and globs in equal parts (taken from the userlist when possible)."""
+    entries = []
+    for i in range(n):
+        u = users[i % len(users)] if users else None
+        kind = i % 3
+        if kind == 0:
+            entries.append(u.nick if u and i < len(users) else f"friend{i}")
+        elif kind == 1:
+            entries.append(f"*!*@{u.host.split('@', 1)[1]}" if u and i < len(users) else f"*!*@trusted{i}.example")
+        else:
+            entries.append(f"*helper{i}*")
+    return entries
+
+def gen_messages(rng, n, words):
+    vocab = [rand_word(rng, 2, 8) for _ in range(500)]
+    msgs = []
+    for _ in range(n):
+        parts = [rng.choice(vocab) for _ in range(rng.randint(3, 20))]
+        if words and rng.random() < HIT_RATE:
+            parts.insert(rng.randrange(len(parts)), rng.choice(words))
+        msgs.append(" ".join(parts))
+    return msgs
+
+# -------------------------
+# Measurement
+# -------------------------
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+def measure(fn, events, alloc_events, repeats=3):
+    """
+    Per-call latency (µs) over all events, best of `repeats` passes to damp
+    scheduler noise, then allocations over the first alloc_events.
+    """
+    lat = None
+    clock = time.perf_counter_ns
+    for _ in range(repeats):
+        run = []
+        for ev in events:
+            t0 = clock()
+            fn(ev)
+            run.append((clock() - t0) / 1000.0)
+        run.sort()
+        if lat is None or percentile(run, 0.99) < percentile(lat, 0.99):
+            lat = run
+
+    sample = events[:alloc_events]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for ev in sample:
+        fn(ev)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(max(0, s.count_diff) for s in stats)
+    size = sum(max(0, s.size_diff) for s in stats)
+    n = max(1, len(sample))
+    return {
+        "events": len(events),
+        "p50_us": round(percentile(lat, 0.50), 2),
+        "p99_us": round(percentile(lat, 0.99), 2),
+        "mean_us": round(sum(lat) / max(1, len(lat)), 2),
+        "retained_blocks_per_event": round(blocks / n, 3),
+        "retained_bytes_per_event": round(size / n, 1),
+    }
+
+def setup(plugin, rng, nick_rules=10, word_rules=10, users=10, exempt=0):
+    automod_offline.reset_runtime(plugin)
+    automod_offline.quiet_settings(plugin)
+    nick_lines, nick_words = gen_rule_lines(rng, nick_rules)
+    word_lines, word_words = gen_rule_lines(rng, word_rules)
+    userlist = gen_users(rng, users)
+    hexchat.users[:] = userlist
+    hexchat.info["channel"] = CHANNEL
+    plugin.publish_ruleset(
+        nick_rules=automod_offline.compile_rules(plugin, nick_lines),
+        word_rules=automod_offline.compile_rules(plugin, word_lines),
+        exempt=gen_exempt(rng, exempt, userlist),
+        protected={CHANNEL},
+    )
+    return nick_words, word_words, userlist
+
+# -------------------------
+# Cases
+# -------------------------
+def bench_on_message(plugin, rng, n_events, rules, users, exempt=5):
+    _, words, userlist = setup(plugin, rng, word_rules=rules, users=users, exempt=exempt)
+    msgs = gen_messages(rng, n_events, words)
+    events = [(rng.choice(userlist).nick, m) for m in msgs]
+
+    def fire(ev):
+        plugin.on_message([ev[0], ev[1]], [ev[0] + " " + ev[1], ev[1]], None)
+        if len(plugin.action_queue) > 1000:
+            plugin.action_queue.clear()
+    return measure(fire, events, min(500, n_events))
+
+def bench_on_join(plugin, rng, n_events, rules, users, exempt=5):
+    words, _, userlist = setup(plugin, rng, nick_rules=rules, users=users, exempt=exempt)
+    events = []
+    for i in range(n_events):
+        nick = f"{rand_word(rng, 3, 6)}{i}"
+        if words and rng.random() < HIT_RATE:
+            nick = f"x{rng.choice(words)}{i}"
+        events.append((nick, f"id@join{i}.example"))
+
+    def fire(ev):
+        hexchat.emit("print", "Join", [ev[0], CHANNEL, ev[1]])
+        if len(plugin.action_queue) > 1000:
+            plugin.action_queue.clear()
+    return measure(fire, events, min(500, n_events))
+
+def bench_is_exempt(plugin, rng, n_events, exempt, users):
+    _, _, userlist = setup(plugin, rng, users=users, exempt=exempt)
+    events = [rng.choice(userlist).nick if rng.random() < 0.5 else f"stranger{i}" for i in range(n_events)]
+    return measure(lambda nick: plugin.is_exempt(nick, CHANNEL), events, min(500, n_events))
+
+def run_all(quick=False):
+    plugin = automod_offline.load_plugin()
+    rng = random.Random(1234)
+    n = 300 if quick else 2000
+    results = {}
+    for rules in (10, 1000, 10000):
+        results[f"on_message rules={rules} users=1000"] = bench_on_message(plugin, rng, n, rules, 1000)
+    for users in (10, 1000, 5000):
+        results[f"on_message rules=1000 users={users}"] = bench_on_message(plugin, rng, n, 1000, users)
+    for rules in (10, 1000, 10000):
+        results[f"on_join rules={rules} users=1000"] = bench_on_join(plugin, rng, n, rules, 1000)
+    for exempt in (5, 500, 5000):
+        for users in (10, 5000):
+            results[f"is_exempt exempt={exempt} users={users}"] = bench_is_exempt(plugin, rng, n, exempt, users)
+    return results
+
+# -------------------------
+# Reporting
+# -------------------------
+def print_table(results, baseline=None):
+    print(f"{'case':44} {'p50 µs':>9} {'p99 µs':>9} {'blocks/ev':>10} {'bytes/ev':>9}" + ("  p99 base" if baseline else ""))
+    for case, r in results.items():
+        line = f"{case:44} {r['p50_us']:9.2f} {r['p99_us']:9.2f} {r['retained_blocks_per_event']:10.3f} {r['retained_bytes_per_event']:9.1f}"
+        if baseline and case in baseline:
+            line += f"  {baseline[case]['p99_us']:8.2f}"
+        print(line)
+
+def regressions(results, baseline):
+    bad = []
+    for case, r in results.items():
+        base = baseline.get(case)
+        if base and r["p99_us"] > base["p99_us"] * REGRESSION_FACTOR + REGRESSION_SLACK_US:
+            bad.append(f"{case}: p99 {r['p99_us']}µs vs baseline {base['p99_us']}µs")
+    return bad
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--save", action="store_true", help=f"write results to {os.path.basename(BASELINE_FILE)}")
+    ap.add_argument("--compare", action="store_true", help="fail when p99 regresses against the baseline")
+    ap.add_argument("--quick", action="store_true", help="fewer events per case")
+    args = ap.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = run_all(quick=args.quick)
+    print_table(results, baseline)
+
+    if args.save:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {BASELINE_FILE}")
+
+    if baseline is not None:
+        bad = regressions(results, baseline)
+        for line in bad:
+            print("REGRESSION " + line)
+        return 1 if bad else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# ============================================================
+#  Offline stand-in for HexChat's `hexchat` Python module
+#  - Lets AutoMod be imported outside HexChat (benchmarks, replay)
+#  - Records command()/prnt() calls instead of sending anything
+#  - Serves get_list("users") / get_list("channels") from plain lists
+# ============================================================
+
+import os
+import tempfile
+
+EAT_NONE = 0
+EAT_HEXCHAT = 1
+EAT_PLUGIN = 2
+EAT_ALL = 3
+
+PRI_HIGHEST = 127
+PRI_HIGH = 64
+PRI_NORM = 0
+PRI_LOW = -64
+PRI_LOWEST = -128
+
+# -------------------------
+# Recorded state
+# -------------------------
+info = {
+    "configdir": os.environ.get("AUTOMOD_CONFIGDIR") or tempfile.mkdtemp(prefix="automod-"),
+    "channel": "#bench",
+    "network": "BenchNet",
+    "server": "irc.bench.test",
+    "nick": "AutoModBench",
+}
+commands = []     # every command() sent, in order
+printed = []      # every prnt() line
+users = []        # what get_list("users") returns (see User)
+hooks = {}        # (kind, name) -> [callback, ...]
+timers = []       # [interval_ms, callback, userdata]
+record = True     # set False to drop command/prnt output (long benchmark runs)
+
+class User(object):
+    __slots__ = ("nick", "host", "account", "realname", "prefix")
+
+    def __init__(self, nick, host=None, account=None, realname=None, prefix=""):
+        self.nick = nick
+        self.host = host
+        self.account = account
+        self.realname = realname
+        self.prefix = prefix
+
+class Context(object):
+    def __init__(self, channel=None, network=None):
+        self.channel = channel or info["channel"]
+        self.network = network or info["network"]
+
+    def __eq__(self, other):
+        return isinstance(other, Context) and (self.channel, self.network) == (other.channel, other.network)
+
+    def __hash__(self):
+        return hash((self.channel, self.network))
+
+    def set(self):
+        info["channel"] = self.channel
+        info["network"] = self.network
+
+    def prnt(self, line):
+        prnt(line)
+
+    def command(self, cmd):
+        command(cmd)
+
+    def emit_print(self, *args):
+        return True
+
+    def get_info(self, key):
+        if key == "channel":
+            return self.channel
+        if key == "network":
+            return self.network
+        return get_info(key)
+
+    def get_list(self, key):
+        return get_list(key)
+
+class ChannelItem(object):
+    def __init__(self, context):
+        self.context = context
+        self.channel = context.channel
+        self.network = context.network
+        self.server = info["server"]
+        self.type = 2
+
+# -------------------------
+# hexchat API
+# -------------------------
+def get_info(key):
+    return info.get(key)
+
+def get_prefs(key):
+    return None
+
+def prnt(line):
+    if record:
+        printed.append(line)
+
+def command(cmd):
+    if record:
+        commands.append(cmd)
+
+def emit_print(*args):
+    return True
+
+def strip(text, length=-1, flags=3):
+    return text
+
+def nickcmp(a, b):
+    a, b = a.lower(), b.lower()
+    return (a > b) - (a < b)
+
+def find_context(server=None, channel=None):
+    return Context(channel)
+
+def get_context():
+    return Context()
+
+def get_list(key):
+    if key == "users":
+        return users
+    if key == "channels":
+        return [ChannelItem(Context())]
+    return []
+
+def _hook(kind, name, callback, userdata=None):
+    handle = (kind, name, callback, userdata)
+    hooks.setdefault((kind, name), []).append(handle)
+    return handle
+
+def hook_print(name, callback, userdata=None, priority=PRI_NORM):
+    return _hook("print", name, callback, userdata)
+
+def hook_server(name, callback, userdata=None, priority=PRI_NORM):
+    return _hook("server", name, callback, userdata)
+
+def hook_command(name, callback, userdata=None, priority=PRI_NORM, help=None):
+    return _hook("command", name.upper(), callback, userdata)
+
+def hook_unload(callback, userdata=None):
+    return _hook("unload", "", callback, userdata)
+
+def hook_timer(timeout, callback, userdata=None):
+    handle = [timeout, callback, userdata]
+    timers.append(handle)
+    return handle
+
+def unhook(handle):
+    if handle in timers:
+        timers.remove(handle)
+        return
+    for handles in hooks.values():
+        if handle in handles:
+            handles.remove(handle)
+
+# -------------------------
+# Driving helpers (not part of the real API)
+# -------------------------
+def run_timers(rounds=1):
+    """Fire every pending timer once per round; drop the ones that return False."""
+    for _ in range(rounds):
+        for handle in list(timers):
+            if handle in timers and not handle[1](handle[2]):
+                if handle in timers:
+                    timers.remove(handle)
+
+def emit(kind, name, word, word_eol=None):
+    """Call the hooks registered for an event like HexChat would."""
+    for _, _, callback, userdata in list(hooks.get((kind, name), [])):
+        callback(word, word_eol if word_eol is not None else word, userdata)
+
+def reset():
+    del commands[:]
+    del printed[:]
+    del timers[:]
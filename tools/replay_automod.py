@@ -0,0 +1,341 @@
+"""
+AutoMod log replay (dry run): streams HexChat channel logs or automod_log.txt
+through the plugin's own Join / Channel Message handlers - rules, exempt list,
+flood and duplicate-line detection - and reports who would have been banned.
+Nothing is sent; bans are counted instead of queued, and a banned user's
+later lines in that channel are skipped until they join again.
+
+    python tools/replay_automod.py ~/.config/hexchat/logs/Libera/
+    python tools/replay_automod.py --words new_bad_words.txt --jobs 8 logs/
+    python tools/replay_automod.py --config ~/.config/hexchat --json report.json automod_log.txt
+
+Rule, exempt and settings files come from --config (its addons/ folder) and
+can be overridden one by one; they are copied to a scratch folder first, so
+the live configuration is never written to. Channels are split across --jobs
+worker processes, each channel always on the same worker so flood state sees
+the channel's lines in order. HexChat logs carry no year, so only the time
+between lines is meaningful. Join-flood lockdown is not replayed (it defers
+the joiners it would check); all channels count as protected unless
+--protected-only is given.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import automod_offline  # noqa: E402
+import hexchat  # noqa: E402
+
+CHUNK_EVENTS = 2000       # events per message to a worker
+QUEUE_CHUNKS = 8          # chunks buffered per worker before the reader waits
+CONFIG_FILES = ("bad_nicks.txt", "bad_words.txt", "exempt.txt", "protected_channels.txt", "automod_settings.json")
+
+# -------------------------
+# Reading & parsing (generators)
+# -------------------------
+MONTHS = {m: i for i, m in enumerate(("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                      "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"))}
+HEXCHAT_LINE_RE = re.compile(r"^(\w{3}) +(\d{1,2}) (\d\d):(\d\d):(\d\d) (.*)$")
+HEXCHAT_MSG_RE = re.compile(r"^<([^>]+)>\t(.*)$")
+HEXCHAT_JOIN_RE = re.compile(r"^-->\t(\S+) \(([^)]*)\) has joined (\S+)")
+HEXCHAT_LEAVE_RE = re.compile(r"^<--\t(\S+) \(([^)]*)\) has (left|quit)")
+AUTOMOD_LINE_RE = re.compile(r"^(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d) - .*\[(.*)\]$")
+NICK_PREFIXES = "~&@%+"
+
+def iter_log_files(paths):
+    """Expand directories into the .log / .txt files below them."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith((".log", ".txt")):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def read_lines(path):
+    with open(path, "rb") as f:
+        for raw in f:
+            yield raw.decode("utf-8", "replace").rstrip("\r\n")
+
+def parse_hexchat_log(path, lines):
+    """HexChat '<nick>\\tmessage' / '-->' / '<--' lines -> events (kind, network, channel, ts, nick, extra)."""
+    channel = os.path.splitext(os.path.basename(path))[0]
+    network = os.path.basename(os.path.dirname(os.path.abspath(path)))   # logs/<network>/<channel>.log
+    for line in lines:
+        m = HEXCHAT_LINE_RE.match(line)
+        if not m:
+            continue
+        mon, day, hh, mm, ss, rest = m.groups()
+        ts = (((MONTHS.get(mon, 0) * 31 + int(day)) * 24 + int(hh)) * 60 + int(mm)) * 60 + int(ss)
+        msg = HEXCHAT_MSG_RE.match(rest)
+        if msg:
+            yield ("msg", network, channel, ts, msg.group(1).lstrip(NICK_PREFIXES), msg.group(2))
+            continue
+        join = HEXCHAT_JOIN_RE.match(rest)
+        if join:
+            yield ("join", network, join.group(3), ts, join.group(1), join.group(2))
+            continue
+        leave = HEXCHAT_LEAVE_RE.match(rest)
+        if leave:
+            yield ("quit" if leave.group(3) == "quit" else "part", network, channel, ts, leave.group(1), leave.group(2))
+
+def parse_automod_log(lines):
+    """automod_log.txt: every (channel, nick) AutoMod acted on is replayed once as a join."""
+    seen = set()
+    for line in lines:
+        m = AUTOMOD_LINE_RE.match(line)
+        if not m:
+            continue
+        fields = dict(f.split("=", 1) for f in m.group(7).split(" ") if "=" in f)
+        channel, nick = fields.get("channel"), fields.get("nick")
+        if not channel or not nick or (channel.lower(), nick.lower()) in seen:
+            continue
+        seen.add((channel.lower(), nick.lower()))
+        ts = int(time.mktime(time.strptime(line[:19], "%Y-%m-%d %H:%M:%S")))
+        yield ("join", "", channel, ts, nick, None)
+
+def iter_events(paths):
+    for path in iter_log_files(paths):
+        lines = read_lines(path)
+        if os.path.basename(path).startswith("automod_log"):
+            yield from parse_automod_log(lines)
+        else:
+            yield from parse_hexchat_log(path, lines)
+
+# -------------------------
+# Replaying one shard
+# -------------------------
+class ReplayClock(object):
+    """Stands in for the plugin's `time` module so flood windows follow log time."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+class Replayer(object):
+    def __init__(self, configdir, opts):
+        self.plugin = plugin = automod_offline.load_plugin(configdir=configdir)
+        self.samples = opts["samples"]
+        self.hits = Counter()
+        self.banned = {}          # rule -> set of (channel, nick)
+        self.examples = {}        # rule -> [(channel, nick, text)]
+        self.events = Counter()
+        self.current = None
+        self.removed = set()      # (network, channel, nick) banned during the replay; their lines are skipped until they rejoin
+
+        self.clock = ReplayClock()
+        plugin.time = self.clock
+        plugin.settings["JOINFLOOD_COUNT"] = 0
+        if opts["no_flood"]:
+            plugin.settings["FLOOD_COUNT"] = 10 ** 9
+            plugin.settings["DUPFLOOD_NICKS"] = 0
+        if not opts["protected_only"]:
+            plugin.is_protected = lambda channel, rs=None, network=None: bool(channel)
+        plugin.apply_ban_and_kick = self.record_ban
+
+    def record_ban(self, channel, nick, reason, duration_minutes=None, rule=None, key=None):
+        rule = rule or "?"
+        self.hits[rule] += 1
+        self.banned.setdefault(rule, set()).add((channel.lower(), nick.lower()))
+        self.removed.add((key or self.plugin.chan_key(channel)) + (nick.lower(),))
+        examples = self.examples.setdefault(rule, [])
+        if len(examples) < self.samples:
+            kind, _, _, _, ev_nick, extra = self.current
+            text = extra if kind == "msg" else f"(join {ev_nick})"
+            examples.append((channel, nick, text))
+
+    def replay(self, events):
+        plugin = self.plugin
+        for ev in events:
+            kind, network, channel, ts, nick, extra = ev
+            self.current = ev
+            self.clock.now = float(ts)
+            hexchat.info["channel"] = channel
+            hexchat.info["network"] = network or "Replay"
+            self.events[kind] += 1
+            key = plugin.chan_key(channel)
+            if key not in plugin.host_index:
+                plugin.seed_host_index(key)
+            user = key + (nick.lower(),)
+            if self.removed and user in self.removed:
+                if kind != "join":
+                    continue
+                self.removed.discard(user)
+            if kind == "msg":
+                hexchat.emit("print", "Channel Message", [nick, extra], [f"{nick} {extra}", extra])
+            elif kind == "join":
+                hexchat.emit("print", "Join", [nick, channel, extra or ""])
+            elif kind == "part":
+                hexchat.emit("print", "Part", [nick, extra or "", channel])
+            elif kind == "quit":
+                hexchat.emit("print", "Quit", [nick, "", extra or ""])
+        # nothing runs the plugin's timers here; drop what they would have flushed
+        del plugin.log_buffer[:]
+        del hexchat.timers[:]
+
+    def result(self):
+        return {
+            "events": dict(self.events),
+            "hits": dict(self.hits),
+            "banned": {rule: sorted(users) for rule, users in self.banned.items()},
+            "examples": self.examples,
+        }
+
+def shard_worker(template, opts, inbox, outbox):
+    configdir = tempfile.mkdtemp(prefix="automod-replay-")
+    try:
+        shutil.copytree(template, configdir, dirs_exist_ok=True)
+        replayer = Replayer(configdir, opts)
+        while True:
+            chunk = inbox.get()
+            if chunk is None:
+                break
+            replayer.replay(chunk)
+        outbox.put(replayer.result())
+    finally:
+        shutil.rmtree(configdir, ignore_errors=True)
+
+# -------------------------
+# Driver
+# -------------------------
+def prepare_config(args):
+    """Scratch HexChat config dir holding copies of the rule/exempt/settings files to replay with."""
+    template = tempfile.mkdtemp(prefix="automod-template-")
+    addons = os.path.join(template, "addons")
+    os.makedirs(addons)
+    if args.config:
+        src = os.path.join(args.config, "addons") if os.path.isdir(os.path.join(args.config, "addons")) else args.config
+        for name in CONFIG_FILES:
+            for suffix in ("", ".journal"):
+                path = os.path.join(src, name + suffix)
+                if os.path.exists(path):
+                    shutil.copy2(path, os.path.join(addons, name + suffix))
+    for override, name in ((args.nicks, "bad_nicks.txt"), (args.words, "bad_words.txt"),
+                           (args.exempt, "exempt.txt")):
+        if override:
+            shutil.copy(override, os.path.join(addons, name))
+            journal = os.path.join(addons, name + ".journal")
+            if os.path.exists(journal):
+                os.remove(journal)
+    return template
+
+def chunked(events, size):
+    chunk = []
+    for ev in events:
+        chunk.append(ev)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def merge(results):
+    total = {"events": Counter(), "hits": Counter(), "banned": {}, "examples": {}}
+    for r in results:
+        total["events"].update(r["events"])
+        total["hits"].update(r["hits"])
+        for rule, users in r["banned"].items():
+            total["banned"].setdefault(rule, set()).update(tuple(u) for u in users)
+        for rule, examples in r["examples"].items():
+            total["examples"].setdefault(rule, []).extend(examples)
+    return total
+
+def run(args, opts):
+    template = prepare_config(args)
+    try:
+        events = iter_events(args.logs)
+        if args.jobs <= 1:
+            configdir = tempfile.mkdtemp(prefix="automod-replay-")
+            shutil.copytree(template, configdir, dirs_exist_ok=True)
+            replayer = Replayer(configdir, opts)
+            for chunk in chunked(events, CHUNK_EVENTS):
+                replayer.replay(chunk)
+            shutil.rmtree(configdir, ignore_errors=True)
+            return merge([replayer.result()])
+
+        outbox = multiprocessing.Queue()
+        inboxes = [multiprocessing.Queue(QUEUE_CHUNKS) for _ in range(args.jobs)]
+        workers = [multiprocessing.Process(target=shard_worker, args=(template, opts, q, outbox), daemon=True)
+                   for q in inboxes]
+        for w in workers:
+            w.start()
+        pending = [[] for _ in inboxes]
+        for ev in events:
+            shard = zlib.crc32(f"{ev[1]} {ev[2]}".lower().encode("utf-8")) % len(inboxes)
+            buf = pending[shard]
+            buf.append(ev)
+            if len(buf) >= CHUNK_EVENTS:
+                inboxes[shard].put(buf)
+                pending[shard] = []
+        for q, buf in zip(inboxes, pending):
+            if buf:
+                q.put(buf)
+            q.put(None)
+        results = [outbox.get() for _ in workers]
+        for w in workers:
+            w.join()
+        return merge(results)
+    finally:
+        shutil.rmtree(template, ignore_errors=True)
+
+def report(total, samples):
+    ev = total["events"]
+    users = set()
+    for banned in total["banned"].values():
+        users |= banned
+    print(f"Replayed {sum(ev.values())} events ({ev['msg']} messages, {ev['join']} joins)")
+    print(f"Would ban {len(users)} distinct users with {sum(total['hits'].values())} actions")
+    print(f"{'rule':40} {'hits':>8} {'users':>8}")
+    for rule, hits in total["hits"].most_common():
+        print(f"{rule[:40]:40} {hits:8} {len(total['banned'].get(rule, ())):8}")
+        for channel, nick, text in total["examples"].get(rule, [])[:samples]:
+            print(f"    {channel} <{nick}> {text[:100]}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Dry-run AutoMod rules against channel logs.")
+    ap.add_argument("logs", nargs="+", help="HexChat .log files, log folders or automod_log.txt")
+    ap.add_argument("--config", help="HexChat config dir (or its addons/ folder) to take rules and settings from")
+    ap.add_argument("--nicks", help="bad nicks file to replay instead of the configured one")
+    ap.add_argument("--words", help="bad words file to replay instead of the configured one")
+    ap.add_argument("--exempt", help="exempt list to replay instead of the configured one")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (channels are split between them)")
+    ap.add_argument("--samples", type=int, default=5, help="example lines kept per rule")
+    ap.add_argument("--no-flood", action="store_true", help="only evaluate rules, not flood/duplicate-line detection")
+    ap.add_argument("--protected-only", action="store_true", help="only replay channels in protected_channels.txt")
+    ap.add_argument("--json", help="also write the full report (every banned user) to this file")
+    args = ap.parse_args(argv)
+
+    opts = {"samples": args.samples, "no_flood": args.no_flood, "protected_only": args.protected_only}
+    started = time.time()
+    total = run(args, opts)
+    report(total, args.samples)
+    print(f"Done in {time.time() - started:.1f}s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "events": dict(total["events"]),
+                "hits": dict(total["hits"]),
+                "banned": {rule: sorted(users) for rule, users in total["banned"].items()},
+                "examples": total["examples"],
+            }, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())